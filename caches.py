@@ -0,0 +1,267 @@
+import functools
+import time
+
+from ex import _DoublyLinkedList
+from maps import ChainHashMap
+
+class _EntryList(_DoublyLinkedList):
+    """A _DoublyLinkedList whose nodes are relinked in place when they move,
+    so a node held by the cache index stays valid."""
+    class _Node(_DoublyLinkedList._Node):
+        __slots__ = '_key', '_weight', '_bucket', '_expires', '_count', '_entries'
+
+    def _first(self):
+        """Returns the first node, or None if the list is empty."""
+        return None if self.is_empty() else self._header._next
+
+    def _link_after(self, node, prev):
+        node._prev, node._next = prev, prev._next
+        prev._next._prev = node
+        prev._next = node
+        self._size += 1
+
+    def _append(self, node):
+        self._link_after(node, self._trailer._prev)
+
+    def _unlink(self, node):
+        node._prev._next = node._next
+        node._next._prev = node._prev
+        self._size -= 1
+
+class CacheBase():
+    """Abstract base class for bounded caches.
+
+    Keys are mapped to list nodes by a ChainHashMap, and subclasses keep the
+    nodes in whatever order their eviction policy needs. Each entry weighs
+    weigher(key, value), or 1 without a weigher, and entries are evicted
+    before an insertion would take the total weight past capacity. Entries
+    heavier than the whole capacity are not stored."""
+
+    _MISSING = object()
+
+    #Non-public behaviours
+    def _add(self, node):
+        """Records a newly inserted node with the eviction policy."""
+        raise NotImplementedError("must be implemented by subclass")
+
+    def _remove(self, node):
+        """Removes node from the eviction policy's structures."""
+        raise NotImplementedError("must be implemented by subclass")
+
+    def _touch(self, node):
+        """Records a hit on node."""
+        pass
+
+    def _victim(self):
+        """Returns the node to evict next."""
+        raise NotImplementedError("must be implemented by subclass")
+
+    def _expired(self, node):
+        return False
+
+    def _discard(self, node):
+        del self._index[node._key]
+        self._weight -= node._weight
+        self._remove(node)
+
+    def _lookup(self, k):
+        """Returns the node of k, or None if k is absent or has expired."""
+        node = self._index.get(k)
+        if node is not None and self._expired(node):
+            self._discard(node)
+            self._evictions += 1
+            return None
+        return node
+
+    #Public behaviours
+    def __init__(self, capacity, weigher=None):
+        self._capacity = capacity
+        self._weigher = weigher
+        self._index = ChainHashMap()
+        self._weight = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, k):
+        return self._lookup(k) is not None
+
+    def weight(self):
+        """Returns the total weight of the cached entries."""
+        return self._weight
+
+    def stats(self):
+        """Returns a dict of the hit, miss and eviction counters."""
+        return {'hits': self._hits, 'misses': self._misses,
+                'evictions': self._evictions}
+
+    def get(self, k, d=None):
+        """Returns the value cached for k, or d on a miss."""
+        node = self._lookup(k)
+        if node is None:
+            self._misses += 1
+            return d
+        self._hits += 1
+        self._touch(node)
+        return node._element
+
+    def __getitem__(self, k):
+        value = self.get(k, self._MISSING)
+        if value is self._MISSING:
+            raise KeyError("Key Error: " + repr(k))
+        return value
+
+    def __setitem__(self, k, v):
+        """Caches v under k, evicting entries as needed to stay within the
+        capacity."""
+        w = 1 if self._weigher is None else self._weigher(k, v)
+        old = self._index.get(k)
+        if old is not None:
+            self._discard(old)
+        if w > self._capacity:
+            return
+        while self._weight + w > self._capacity:
+            self._discard(self._victim())
+            self._evictions += 1
+        node = _EntryList._Node(v, None, None)
+        node._key = k
+        node._weight = w
+        self._index[k] = node
+        self._weight += w
+        self._add(node)
+
+    def __delitem__(self, k):
+        self._discard(self._index[k])
+
+    def clear(self):
+        while len(self._index):
+            self._discard(self._victim())
+
+    def memoize(self, func):
+        """Decorator caching the results of func in this cache, keyed on its
+        positional and keyword arguments, which must be hashable."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (args, frozenset(kwargs.items())) if kwargs else args
+            value = self.get(key, self._MISSING)
+            if value is self._MISSING:
+                value = func(*args, **kwargs)
+                self[key] = value
+            return value
+        return wrapper
+
+class LRUCache(CacheBase):
+    """A cache evicting the least recently used entry."""
+
+    def __init__(self, capacity, weigher=None):
+        super().__init__(capacity, weigher)
+        self._order = _EntryList()
+
+    def _add(self, node):
+        self._order._append(node)
+
+    def _remove(self, node):
+        self._order._unlink(node)
+
+    def _touch(self, node):
+        self._order._unlink(node)
+        self._order._append(node)
+
+    def _victim(self):
+        return self._order._first()
+
+class LFUCache(CacheBase):
+    """A cache evicting the least frequently used entry, the least recently
+    used one among ties.
+
+    Entries with the same use count share a bucket, and the buckets are kept
+    in a list by increasing count. A hit moves an entry into the next bucket,
+    creating it if needed, so every operation is O(1)."""
+
+    def __init__(self, capacity, weigher=None):
+        super().__init__(capacity, weigher)
+        self._buckets = _EntryList()
+
+    def _bucket_after(self, prev, count):
+        """Returns the bucket for count following prev, creating it if
+        needed."""
+        bucket = prev._next
+        if bucket is self._buckets._trailer or bucket._count != count:
+            bucket = _EntryList._Node(None, None, None)
+            bucket._count = count
+            bucket._entries = _EntryList()
+            self._buckets._link_after(bucket, prev)
+        return bucket
+
+    def _unlink_entry(self, node):
+        bucket = node._bucket
+        bucket._entries._unlink(node)
+        if bucket._entries.is_empty():
+            self._buckets._unlink(bucket)
+
+    def _add(self, node):
+        node._bucket = self._bucket_after(self._buckets._header, 1)
+        node._bucket._entries._append(node)
+
+    def _remove(self, node):
+        self._unlink_entry(node)
+
+    def _touch(self, node):
+        bucket = self._bucket_after(node._bucket, node._bucket._count + 1)
+        self._unlink_entry(node)
+        node._bucket = bucket
+        bucket._entries._append(node)
+
+    def _victim(self):
+        return self._buckets._first()._entries._first()
+
+class TTLCache(CacheBase):
+    """A cache whose entries expire ttl seconds after they were set.
+
+    Expired entries are dropped lazily when looked up, and by a sweep of the
+    oldest entries run from __setitem__ at most every sweep_interval seconds
+    (ttl by default). Entries are kept in write order, which is also expiry
+    order, so a full cache evicts the entry closest to expiring. Expired
+    entries are counted as evictions."""
+
+    def __init__(self, capacity, ttl, weigher=None, clock=time.monotonic,
+            sweep_interval=None):
+        super().__init__(capacity, weigher)
+        self._ttl = ttl
+        self._clock = clock
+        self._sweep_interval = ttl if sweep_interval is None else sweep_interval
+        self._next_sweep = clock() + self._sweep_interval
+        self._order = _EntryList()
+
+    def _add(self, node):
+        node._expires = self._clock() + self._ttl
+        self._order._append(node)
+
+    def _remove(self, node):
+        self._order._unlink(node)
+
+    def _victim(self):
+        return self._order._first()
+
+    def _expired(self, node):
+        return node._expires <= self._clock()
+
+    def sweep(self):
+        """Removes every expired entry. Returns the number removed."""
+        removed = 0
+        node = self._order._first()
+        while node is not None and self._expired(node):
+            self._discard(node)
+            removed += 1
+            node = self._order._first()
+        self._evictions += removed
+        self._next_sweep = self._clock() + self._sweep_interval
+        return removed
+
+    def __setitem__(self, k, v):
+        if self._clock() >= self._next_sweep:
+            self.sweep()
+        super().__setitem__(k, v)
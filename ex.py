@@ -11,10 +11,10 @@ class _DoublyLinkedList():
 
     def __init__(self):
         """Create an empty list"""
-        self._header=_Node(None, None, None)
-        self._trailer=_Node(None, None, None)
-        self._header._prev=self._trailer
-        self._trailer._next=self._header
+        self._header=self._Node(None, None, None)
+        self._trailer=self._Node(None, None, None)
+        self._header._next=self._trailer
+        self._trailer._prev=self._header
         self._size=0
 
     def __len__(self):
@@ -24,9 +24,9 @@ class _DoublyLinkedList():
         return self._size==0
 
     def _insert_between(self, element, before, after):
-        new_node=Node(element, before, after)
-        before._next=element
-        after._prev=element
+        new_node=self._Node(element, before, after)
+        before._next=new_node
+        after._prev=new_node
         self._size+=1
         return new_node
 
@@ -278,4 +278,4 @@ class RecursiveList():
                 data.append(self._element)
                 data.append(recursive_print(self._rest))
         recursive_print(self)
-        return(", ".join(str(x) for x in data)
+        return(", ".join(str(x) for x in data))
@@ -1,4 +1,14 @@
+import bisect
+import itertools
 import random
+import threading
+import time
+from collections.abc import MutableMapping
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 class MapBase(MutableMapping):
     """Serves as a the abstract base class for all maps."""
@@ -7,12 +17,12 @@ class MapBase(MutableMapping):
 
         def __init__(self, k ,v):
             self._key=k
-            self._value=k
+            self._value=v
         def __eq__(self, other):
             return self._key==other._key
         def __ne__(self, other):
             return not (self==other)
-        def __It__(self, other):
+        def __lt__(self, other):
             return self._key<other._key
 
 class UnsortedTableMap(MapBase):
@@ -24,7 +34,7 @@ class UnsortedTableMap(MapBase):
         for item in self._table:
             if item._key==k:
                 return item._value
-        raise KeyError("Key error: "+k)
+        raise KeyError("Key error: "+repr(k))
 
     def __setitem__(self,k,v):
         """Assigns v to item with key k. Overwrites existing value if any.."""
@@ -41,11 +51,11 @@ class UnsortedTableMap(MapBase):
             if self._table[j]._key==k:
                 self._table.pop(j)
                 return
-        raise KeyError("Key error: "+k)
+        raise KeyError("Key error: "+repr(k))
 
     def __len__(self):
         """Returns the no. of items in the map."""
-        return len(self._data)
+        return len(self._table)
 
     def set_default(self, k, d):
         """Returns the value associated with k if k exists in map. Else sets
@@ -59,28 +69,31 @@ class UnsortedTableMap(MapBase):
     def __iter__(self):
         """Generates an iteration of the map's keys.."""
         for item in self._table:
-            return item._key
+            yield item._key
 
-   def items(self):
-       """Generates an interation of key-value pairs in the map in linear time."""
-       for item in self._table:
-           return (item._key, item._value)
+    def items(self):
+        """Generates an interation of key-value pairs in the map in linear time."""
+        for item in self._table:
+            yield (item._key, item._value)
 
 class HashMapBase(MapBase):
-    class _Item_hash:
-        __slots__ = '_value', '_hash'
-
-        def __init__(self, v, h):
-            self._value = v
-            self._hash = h
+    """Base class for hash maps. If incremental is True, growing the table
+    does not rehash every item at once: the old table is kept alongside the
+    new one and each mutating operation migrates up to migrate_step of its
+    buckets, while lookups consult both tables until it is empty."""
 
-    def __init__(self, cap=10, p=109345121, load_threshold=0.5):
+    def __init__(self, cap=10, p=109345121, load_threshold=0.5,
+            incremental=False, migrate_step=4):
         self._table=[None]*cap
         self._n=0
         self._prime=p
         self._scale=1+random.randrange(p+1)
         self._shift=random.randrange(p)
         self._threshold=load_threshold
+        self._incremental=incremental
+        self._migrate_step=migrate_step
+        self._old=None
+        self._cursor=0
 
     def _hash_function(self,k):
         """Returns the hash code of k."""
@@ -88,21 +101,26 @@ class HashMapBase(MapBase):
 
     def __len__(self):
         """Returns the no. of key-value pairs stored in the map."""
-        return len(self._table)
+        return self._n if self._old is None else self._n+len(self._old)
 
     def __getitem__(self, k):
         """Returns the item associated with k."""
         j=self._hash_function(k)
-        return self._bucket_getitem(j,k)
+        if self._old is None:
+            return self._bucket_getitem(j,k)
+        try:
+            return self._bucket_getitem(j,k)
+        except KeyError:
+            return self._old[k]
 
     def __setitem__(self,k,v):
         """Sets k to be associated with v. Resizes the table to maintain load
         factor."""
-        if v.isinstance(self._Item_hash):
-            j = v._hash_code
-            v = v._value
-        else:
-            j = self._hash_function(k)
+        if self._old is not None:
+            if k in self._old:
+                del self._old[k]
+            self._migrate(self._migrate_step)
+        j = self._hash_function(k)
         self._bucket_setitem(j, k, v)
         if self._n>len(self._table) * self._threshold:
             self._resize(2*len(self._table)-1)
@@ -110,15 +128,138 @@ class HashMapBase(MapBase):
     def __delitem__(self,k):
         """Deletes the item associated with k. Decrements n."""
         j=self._hash_function(k)
-        self._bucket_delitem(j,k)
-        self._n-=1
+        if self._old is None:
+            self._bucket_delitem(j,k)
+            self._n-=1
+            return
+        try:
+            self._bucket_delitem(j,k)
+            self._n-=1
+        except KeyError:
+            del self._old[k]
+        self._migrate(self._migrate_step)
 
     def _resize(self,n):
-        old_items=list(self.items())
+        if not self._incremental:
+            old_items=list(self.items())
+            self._table=[None]*n
+            self._n=0
+            for (k,v) in old_items:
+                self[k]=v
+            return
+        #Finish any migration still in progress before starting a new one.
+        self._migrate(len(self._old._table) if self._old is not None else 0)
+        old=object.__new__(type(self))
+        old.__dict__.update(self.__dict__)
+        old._incremental=False
+        self._old=old
+        self._cursor=0
         self._table=[None]*n
         self._n=0
-        for (k,v) in old_items:
-            self[k]=v
+
+    def _migrate(self, buckets):
+        """Moves the items of up to buckets buckets of the old table into the
+        current one, and drops the old table once it is empty."""
+        old=self._old
+        if old is None:
+            return
+        #Only stop in front of an empty bucket, so that no remaining item of
+        #a probing table has to be found past a bucket that was cleared.
+        while self._cursor<len(old._table) and \
+                (buckets>0 or old._table[self._cursor] is not None):
+            items=old._bucket_items(self._cursor)
+            old._table[self._cursor]=None
+            old._n-=len(items)
+            for k,v in items:
+                self._bucket_setitem(self._hash_function(k), k, v)
+            self._cursor+=1
+            buckets-=1
+        if self._cursor==len(old._table) or not old._n:
+            self._old=None
+
+    def __iter__(self):
+        """Generates an iteration of all keys in the map."""
+        for j in range(len(self._table)):
+            for k, v in self._bucket_items(j):
+                yield k
+        if self._old is not None:
+            yield from self._old
+
+    def _hash_many(self, keys):
+        """Returns the list of bucket indices of keys, hashed in one pass."""
+        scale, shift, p, m = self._scale, self._shift, self._prime, len(self._table)
+        return [(hash(k)*scale+shift)%p%m for k in keys]
+
+    def _reserve(self, n):
+        """Grows the table, rehashing every item once, so that n items fit
+        within the load threshold. Finishes any incremental migration."""
+        if self._old is not None:
+            self._migrate(len(self._old._table))
+        cap=int(n/self._threshold)+1
+        if cap<=len(self._table):
+            return
+        items=[kv for j in range(len(self._table)) for kv in self._bucket_items(j)]
+        self._table=[None]*cap
+        self._n=0
+        for (k,v),j in zip(items, self._hash_many(k for k,v in items)):
+            self._bucket_setitem(j,k,v)
+
+    @classmethod
+    def from_items(cls, iterable, size_hint=None, batch=65536, **kwargs):
+        """Builds a map from an iterable of (key, value) pairs. The table is
+        sized once from size_hint, or from len(iterable) when it has one, and
+        the pairs are inserted in batches of batch. Extra keyword arguments
+        are passed to the constructor."""
+        m=cls(**kwargs)
+        if size_hint is None and hasattr(iterable, '__len__'):
+            size_hint=len(iterable)
+        if size_hint is not None:
+            m._reserve(size_hint)
+        it=iter(iterable)
+        while True:
+            chunk=list(itertools.islice(it, batch))
+            if not chunk:
+                return m
+            m.update_many(chunk)
+
+    def update_many(self, pairs):
+        """Sets every (key, value) pair of pairs, or of pairs.items() if it is
+        a mapping. The table is grown at most once for the whole batch."""
+        if hasattr(pairs, 'items'):
+            pairs=pairs.items()
+        pairs=list(pairs)
+        self._reserve(len(self)+len(pairs))
+        for (k,v),j in zip(pairs, self._hash_many(k for k,v in pairs)):
+            self._bucket_setitem(j,k,v)
+
+    def get_many(self, keys, default=None):
+        """Returns a list of the values of keys, default for missing ones."""
+        if self._old is not None:
+            return [self.get(k, default) for k in keys]
+        keys=list(keys)
+        values=[]
+        for k,j in zip(keys, self._hash_many(keys)):
+            try:
+                values.append(self._bucket_getitem(j,k))
+            except KeyError:
+                values.append(default)
+        return values
+
+    def delete_many(self, keys):
+        """Deletes every key of keys present in the map, skipping missing
+        ones. Returns the number of items deleted."""
+        if self._old is not None:
+            self._migrate(len(self._old._table))
+        keys=list(keys)
+        deleted=0
+        for k,j in zip(keys, self._hash_many(keys)):
+            try:
+                self._bucket_delitem(j,k)
+            except KeyError:
+                continue
+            self._n-=1
+            deleted+=1
+        return deleted
 
 class ChainHashMap(HashMapBase):
     """Hash map implementation using separate chaining for collision
@@ -128,22 +269,14 @@ class ChainHashMap(HashMapBase):
         bucket = self._table[j]
         if bucket is None:
             raise KeyError("Key Error: "+repr(k))
-        return bucket[k]._value
+        return bucket[k]
 
     def _bucket_setitem(self,j,k,v):
-        #If bucket does not have an existing item, store new item directly to
-        #bucket.
         if self._table[j] is None:
-            self._table[j] = self._Item(k, self._Item_hash(v, j))
-        #If updating an existing bucket with only one item:
-        elif self._table[j]._key == k:
-            self._table[j]._value._value = v
-        #If collision occurs and a new item must be assigned to same bucket.
-        else:
-            old_item = self._table[j]
             self._table[j] = UnsortedTableMap()
-            self._table[j][old_item._key] = old_item._value
-            self._table[j][k] = self._Item_hash(v, j)
+        old_size = len(self._table[j])
+        self._table[j][k] = v
+        if len(self._table[j]) > old_size:
             self._n += 1
 
     def _bucket_delitem(self,j,k):
@@ -151,27 +284,12 @@ class ChainHashMap(HashMapBase):
         bucket = self._table[j]
         if bucket is None:
             raise KeyError("Key Error: "+repr(k))
-        #If bucket stores a single item directly that matches search.
-        elif bucket._key == k:
-            self._table[j] = None
-        else:
-            del bucket[k]
+        del bucket[k]
 
-    def __iter__(self):
-        """Generates an iteration of all keys in the map."""
-        for bucket in self._table:
-            if bucket is not None:
-                for key in bucket:
-                    yield key
-
-    def setdefault(self, k, d):
-        """Returns the value of k if k is in the map. Else assigns the value d
-        to key k."""
-        j = self._hash_function(k)
+    def _bucket_items(self, j):
+        """Returns a list of the (key, value) pairs stored in bucket j."""
         bucket = self._table[j]
-        if bucket is None:
-            self._table[j] = UnsortedTableMap()
-        return self._table[j].setdefault(k, d)
+        return [] if bucket is None else list(bucket.items())
 
 class ProbeHashMap(HashMapBase):
     """A hash map that implements linear probing for open-addressing collision resolution."""
@@ -185,7 +303,9 @@ class ProbeHashMap(HashMapBase):
         """Utility function to find the bucket for key k using linear probing.
         Returns False and the first available bucket if k is not found."""
         first_avail=None
-        while True:
+        #Give up after one full cycle, the table may hold no None at all
+        #once enough slots have been marked _AVAIL.
+        for _ in range(len(self._table)):
             if self._is_available(j):
                 if first_avail is None:
                     first_avail = j
@@ -194,6 +314,7 @@ class ProbeHashMap(HashMapBase):
             elif k == self._table[j]._key:
                 return (True, j)
             j = (j+1) % len(self._table)
+        return (False, first_avail)
 
     def _bucket_getitem(self, j, k):
         """Returns the value associated with k in the map."""
@@ -219,124 +340,769 @@ class ProbeHashMap(HashMapBase):
             raise KeyError("Key Error: " + repr(k))
         self._table[slot] = ProbeHashMap._AVAIL
 
+    def _bucket_items(self, j):
+        """Returns a list of the (key, value) pair stored in slot j, if any."""
+        if self._is_available(j):
+            return []
+        return [(self._table[j]._key, self._table[j]._value)]
+
+class RobinHoodHashMap(MapBase):
+    """An open-addressing hash map using Robin Hood linear probing.
+
+    Hashes, keys and values are stored in three parallel arrays instead of
+    one _Item per slot. Each hash is scrambled once with Fibonacci hashing
+    and cached, so probes compare cached hashes before keys and resizing
+    never calls hash() again. On insertion, an entry that is further from
+    its home slot takes the place of one that is closer, which keeps probe
+    sequences short. Deletion shifts the following entries of the cluster
+    back by one slot instead of leaving tombstones, so lookups stay fast
+    under heavy delete churn."""
+
+    _GOLDEN = 0x9E3779B97F4A7C15
+    _MASK64 = (1 << 64) - 1
+
+    #Non-public behaviours
+    def _hash(self, k):
+        """Returns the cached 64-bit hash of k."""
+        return ((hash(k) & self._MASK64) * self._GOLDEN) & self._MASK64
+
+    def _home(self, h):
+        """Returns the home slot of the cached hash h."""
+        return h >> self._shift
+
+    def _allocate(self, bits):
+        cap = 1 << bits
+        self._shift = 64 - bits
+        self._mask = cap - 1
+        self._hashes = [None] * cap
+        self._keys = [None] * cap
+        self._values = [None] * cap
+
+    def _find(self, h, k):
+        """Returns the slot of key k with cached hash h, or -1 if k is not in
+        the map."""
+        hashes, keys, mask = self._hashes, self._keys, self._mask
+        j = self._home(h)
+        dist = 0
+        while True:
+            slot_hash = hashes[j]
+            if slot_hash is None:
+                return -1
+            #An entry closer to its home than we are to ours means k would
+            #have displaced it, so k is not in the map.
+            if (j - self._home(slot_hash)) & mask < dist:
+                return -1
+            if slot_hash == h and (keys[j] is k or keys[j] == k):
+                return j
+            j = (j + 1) & mask
+            dist += 1
+
+    def _insert(self, h, k, v):
+        """Inserts a key that is known not to be in the map."""
+        hashes, keys, values, mask = self._hashes, self._keys, self._values, \
+            self._mask
+        j = self._home(h)
+        dist = 0
+        while hashes[j] is not None:
+            slot_dist = (j - self._home(hashes[j])) & mask
+            if slot_dist < dist:
+                #Rob the richer entry of its slot and carry it on instead.
+                h, hashes[j] = hashes[j], h
+                k, keys[j] = keys[j], k
+                v, values[j] = values[j], v
+                dist = slot_dist
+            j = (j + 1) & mask
+            dist += 1
+        hashes[j] = h
+        keys[j] = k
+        values[j] = v
+
+    def _resize(self, bits):
+        """Rehashes every entry into a table of 2**bits slots, reusing the
+        cached hashes."""
+        old = zip(self._hashes, self._keys, self._values)
+        self._allocate(bits)
+        for h, k, v in old:
+            if h is not None:
+                self._insert(h, k, v)
+
+    #Public behaviours
+    def __init__(self, cap=16, load_threshold=0.8):
+        self._allocate(max(cap - 1, 1).bit_length())
+        self._n = 0
+        self._threshold = load_threshold
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, k):
+        j = self._find(self._hash(k), k)
+        if j < 0:
+            raise KeyError("Key Error: " + repr(k))
+        return self._values[j]
+
+    def __setitem__(self, k, v):
+        h = self._hash(k)
+        j = self._find(h, k)
+        if j >= 0:
+            self._values[j] = v
+            return
+        if self._n + 1 > len(self._hashes) * self._threshold:
+            self._resize(64 - self._shift + 1)
+        self._insert(h, k, v)
+        self._n += 1
+
+    def __delitem__(self, k):
+        j = self._find(self._hash(k), k)
+        if j < 0:
+            raise KeyError("Key Error: " + repr(k))
+        hashes, keys, values, mask = self._hashes, self._keys, self._values, \
+            self._mask
+        #Backward shift: pull the rest of the cluster one slot closer to home
+        #until an empty slot or an entry already at its home is reached.
+        nxt = (j + 1) & mask
+        while hashes[nxt] is not None and (nxt - self._home(hashes[nxt])) & mask:
+            hashes[j] = hashes[nxt]
+            keys[j] = keys[nxt]
+            values[j] = values[nxt]
+            j = nxt
+            nxt = (j + 1) & mask
+        hashes[j] = keys[j] = values[j] = None
+        self._n -= 1
+        bits = 64 - self._shift
+        if bits > 4 and self._n < len(hashes) * self._threshold / 4:
+            self._resize(bits - 1)
+
     def __iter__(self):
-        """Generates an iteration of keys in the map."""
-        for j in range(len(self._table)):
-            if not self._is_available(j):
-                yield self._table[j]._key
+        for j in range(len(self._hashes)):
+            if self._hashes[j] is not None:
+                yield self._keys[j]
 
-    def setdefault(self, k, d):
-        j = self._hash_function(k)
-        found, slot = self._find_slot(j, k)
-        if found:
-            return self._table[slot]._value
-        else:
-            self._table[slot]._value = d
+    def items(self):
+        """Generates an iteration of (key, value) pairs in the map."""
+        for j in range(len(self._hashes)):
+            if self._hashes[j] is not None:
+                yield (self._keys[j], self._values[j])
+
+class ShardedHashMap(MapBase):
+    """A thread-safe hash map striped over 2**bits independent shards.
+
+    Each key is routed to a shard by the high bits of its Fibonacci-hashed
+    hash, and each shard is a map_class instance guarded by its own lock, so
+    threads working on different shards never wait for each other and a
+    shard resizes without blocking the rest. Iteration copies one shard at a
+    time under its lock and yields from the copies, so it never holds a lock
+    while the caller runs; it is a snapshot of each shard, not of the whole
+    map."""
+
+    _GOLDEN = 0x9E3779B97F4A7C15
+    _MASK64 = (1 << 64) - 1
+
+    #Non-public behaviours
+    def _shard_index(self, k):
+        return (((hash(k) & self._MASK64) * self._GOLDEN) & self._MASK64) >> self._shift
+
+    def _snapshot(self, j):
+        """Returns a list of the (key, value) pairs of shard j."""
+        with self._locks[j]:
+            return list(self._shards[j].items())
+
+    #Public behaviours
+    def __init__(self, bits=4, map_class=None, **kwargs):
+        """Creates 2**bits shards of map_class, ChainHashMap by default. Extra
+        keyword arguments are passed to every shard's constructor."""
+        if map_class is None:
+            map_class = ChainHashMap
+        self._shift = 64 - bits
+        self._shards = [map_class(**kwargs) for _ in range(1 << bits)]
+        self._locks = [threading.Lock() for _ in range(1 << bits)]
+
+    def __getitem__(self, k):
+        j = self._shard_index(k)
+        with self._locks[j]:
+            return self._shards[j][k]
+
+    def __setitem__(self, k, v):
+        j = self._shard_index(k)
+        with self._locks[j]:
+            self._shards[j][k] = v
+
+    def __delitem__(self, k):
+        j = self._shard_index(k)
+        with self._locks[j]:
+            del self._shards[j][k]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def __contains__(self, k):
+        j = self._shard_index(k)
+        with self._locks[j]:
+            return k in self._shards[j]
+
+    def get(self, k, d=None):
+        j = self._shard_index(k)
+        with self._locks[j]:
+            return self._shards[j].get(k, d)
+
+    def setdefault(self, k, d=None):
+        """Atomically returns the value of k, first setting it to d if k is
+        not in the map."""
+        j = self._shard_index(k)
+        with self._locks[j]:
+            return self._shards[j].setdefault(k, d)
+
+    def pop(self, k, *default):
+        """Atomically removes k and returns its value."""
+        j = self._shard_index(k)
+        with self._locks[j]:
+            return self._shards[j].pop(k, *default)
+
+    def update_many(self, pairs):
+        """Sets every (key, value) pair of pairs, taking each shard's lock
+        once for all of its pairs."""
+        if hasattr(pairs, 'items'):
+            pairs = pairs.items()
+        groups = [[] for _ in self._shards]
+        for k, v in pairs:
+            groups[self._shard_index(k)].append((k, v))
+        for j, group in enumerate(groups):
+            if group:
+                with self._locks[j]:
+                    self._shards[j].update_many(group)
+
+    def __iter__(self):
+        for j in range(len(self._shards)):
+            for k, v in self._snapshot(j):
+                yield k
+
+    def items(self):
+        """Generates an iteration of (key, value) pairs, one shard snapshot
+        at a time."""
+        for j in range(len(self._shards)):
+            yield from self._snapshot(j)
 
 class SortedTableMap(MapBase):
-    """A sorted search table implementation of a map."""
+    """A sorted search table implementation of a map.
+
+    Items are kept in sorted chunks of about _LOAD items, with keys and
+    values in parallel lists and the largest key of every chunk in _maxes.
+    A search bisects _maxes and then one key chunk, and an insertion or
+    deletion only moves the items of one chunk. Chunks are split when they
+    grow past twice _LOAD and merged with a neighbour when they shrink below
+    half of it. A Fenwick tree over the chunk lengths, rebuilt lazily when
+    chunks are split or merged, maps between chunk positions and indices in
+    the whole table."""
+
+    _LOAD = 1000
+
+    class RangeView():
+        """A read-only view of the items at indices lo to hi of a
+        SortedTableMap. It copies nothing: len() is O(1), indexing is
+        O(log n) and iteration walks the chunks in place. The view is by
+        position, so it is only meaningful until the map is modified."""
+        __slots__ = '_map', '_lo', '_hi'
+
+        def __init__(self, table, lo, hi):
+            self._map = table
+            self._lo = lo
+            self._hi = max(lo, hi)
+
+        def __len__(self):
+            return self._hi - self._lo
+
+        def __getitem__(self, index):
+            if isinstance(index, slice):
+                lo, hi, step = index.indices(len(self))
+                if step != 1:
+                    raise ValueError("RangeView slices must have step 1")
+                return type(self)(self._map, self._lo + lo, self._lo + hi)
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("Index out of range")
+            return self._map.select(self._lo + index)
+
+        def __iter__(self):
+            if self._lo < self._hi:
+                i, j = self._map._position(self._lo)
+                yield from itertools.islice(self._map._items_from(i, j), len(self))
 
     #Non-public behaviours
-    def _find_index(self, k, low, high):
-        """Searches the map for k and returns its index using Binary Search.
-        If k is not found, index of smallest element with key>k is returned."""
-        if high<low:
-            return high + 1
-        mid = (low + high) // 2
-        if self._table[mid] == k:
-            return mid
-        elif self._table[mid] < k:
-            return self._find_index(k, mid + 1, high)
+    def _find_index(self, k):
+        """Returns the chunk and the position in it of the first key >= k,
+        or (number of chunks, 0) if every key is smaller than k."""
+        i = bisect.bisect_left(self._maxes, k)
+        if i == len(self._maxes):
+            return (i, 0)
+        return (i, bisect.bisect_left(self._keys[i], k))
+
+    def _split(self, i):
+        """Splits chunk i in two halves."""
+        half = len(self._keys[i]) // 2
+        self._keys.insert(i + 1, self._keys[i][half:])
+        self._values.insert(i + 1, self._values[i][half:])
+        del self._keys[i][half:]
+        del self._values[i][half:]
+        self._maxes.insert(i, self._keys[i][-1])
+        self._tree = None
+
+    def _rebalance(self, i):
+        """Drops chunk i if it is empty, or merges it into a neighbour if it
+        holds fewer than half of _LOAD items."""
+        if not self._keys[i]:
+            del self._keys[i], self._values[i], self._maxes[i]
+            self._tree = None
+        elif len(self._keys[i]) < self._LOAD // 2 and len(self._keys) > 1:
+            if i == len(self._keys) - 1:
+                i -= 1
+            self._keys[i] += self._keys.pop(i + 1)
+            self._values[i] += self._values.pop(i + 1)
+            del self._maxes[i]
+            #The merged chunk may have lost its largest key to the delete.
+            self._maxes[i] = self._keys[i][-1]
+            self._tree = None
+            if len(self._keys[i]) > 2 * self._LOAD:
+                self._split(i)
         else:
-            return self._find_index(k, low, mid - 1)
+            self._maxes[i] = self._keys[i][-1]
+            self._index_update(i, -1)
+
+    def _build_index(self):
+        tree = [len(chunk) for chunk in self._keys]
+        for i in range(len(tree)):
+            parent = i | (i + 1)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _index_update(self, i, delta):
+        """Adds delta to the length of chunk i in the Fenwick tree."""
+        tree = self._tree
+        if tree is None:
+            return
+        while i < len(tree):
+            tree[i] += delta
+            i |= i + 1
+
+    def _offset(self, i):
+        """Returns the number of items in the chunks before chunk i."""
+        if self._tree is None:
+            self._build_index()
+        tree = self._tree
+        total = 0
+        while i > 0:
+            total += tree[i - 1]
+            i &= i - 1
+        return total
+
+    def _position(self, index):
+        """Returns the chunk and the position in it of the item at index in
+        the whole table, for 0 <= index < len(self)."""
+        if self._tree is None:
+            self._build_index()
+        tree = self._tree
+        i = 0
+        bit = 1 << (len(tree).bit_length() - 1)
+        while bit:
+            if i + bit <= len(tree) and tree[i + bit - 1] <= index:
+                index -= tree[i + bit - 1]
+                i += bit
+            bit >>= 1
+        return (i, index)
+
+    def _item(self, i, j):
+        return (self._keys[i][j], self._values[i][j])
+
+    def _items_from(self, i, j, stop=None):
+        """Generates the (key, value) pairs from chunk i, position j onwards,
+        while key < stop."""
+        while i < len(self._keys):
+            keys = self._keys[i]
+            if stop is None or keys[-1] < stop:
+                end = len(keys)
+            else:
+                end = bisect.bisect_left(keys, stop, j)
+            yield from zip(keys[j:end], self._values[i][j:end])
+            if end < len(keys):
+                return
+            i, j = i + 1, 0
 
     #Public Behaviours
     def __init__(self):
-        self._table=[]
+        self._keys = []
+        self._values = []
+        self._maxes = []
+        self._tree = []
+        self._n = 0
 
     def __len__(self):
-        return len(self._table)
+        return self._n
 
     def __getitem__(self, k):
         """Returns the value associated with k. Raises KeyError is not found."""
-        index = self._find_index(k, 0, len(self._table)-1)
-        if index == len(self._table) or self._table[index]._key != k:
+        i, j = self._find_index(k)
+        if i == len(self._keys) or self._keys[i][j] != k:
             raise KeyError("Key error: " + repr(k))
-        return self._table[index]._value
+        return self._values[i][j]
 
     def __setitem__(self, k, v):
-        index = self._find_index(k, 0, len(self._table) - 1)
-        if self._table[index]._key == k and index < len(self._table):
-            self._table[index]._value = v
+        if not self._keys:
+            self._keys.append([k])
+            self._values.append([v])
+            self._maxes.append(k)
+            self._tree = None
+            self._n = 1
+            return
+        i = bisect.bisect_left(self._maxes, k)
+        if i == len(self._maxes):
+            #Larger than every key, append to the last chunk.
+            i -= 1
+            self._keys[i].append(k)
+            self._values[i].append(v)
+            self._maxes[i] = k
         else:
-            self._table.insert(index, self._Item(k,v))
-            self._n += 1
+            keys = self._keys[i]
+            j = bisect.bisect_left(keys, k)
+            if keys[j] == k:
+                self._values[i][j] = v
+                return
+            keys.insert(j, k)
+            self._values[i].insert(j, v)
+        self._n += 1
+        if len(self._keys[i]) > 2 * self._LOAD:
+            self._split(i)
+        else:
+            self._index_update(i, 1)
 
     def __delitem__(self, k):
-        index = self._find_index(k, 0 ,len(self._table - 1))
-        if index == len(self._table) or self._table[index]._key != k:
+        i, j = self._find_index(k)
+        if i == len(self._keys) or self._keys[i][j] != k:
             raise KeyError("Key error: " + repr(k))
-        self._table.pop(index)
+        del self._keys[i][j]
+        del self._values[i][j]
+        self._n -= 1
+        self._rebalance(i)
 
     def __iter__(self):
-        for item in self._table:
-            yield item._key
+        for keys in self._keys:
+            yield from keys
+
+    def items(self):
+        """Generates an iteration of (key, value) pairs in key order."""
+        for keys, values in zip(self._keys, self._values):
+            yield from zip(keys, values)
 
     def find_min(self):
-        if len(self._table) > 0:
-            return (self._table[0]._key, self._table[0]._value)
+        if self._n > 0:
+            return self._item(0, 0)
         return None
 
     def find_max(self):
-        if len(self._table) > 0:
-            return (self._table[-1]._key, self._table[-1]._value)
+        if self._n > 0:
+            return self._item(-1, -1)
         return None
 
     def find_ge(self, k):
         """Return the smallest item with key greater than or equal to k."""
-
-        index = self._find_index(k, 0, len(self._table)-1)
-        if index == len(self._table):
+        i, j = self._find_index(k)
+        if i == len(self._keys):
             return None
-        return (self._table[index]._key, self._table[index]._value)
+        return self._item(i, j)
 
     def find_lt(self, k):
         """Return the largest item with key stricly less than k."""
-
-        index = self._find_index(k, 0, len(self._table)-1)
-        if index > 0:
-            return (self._table[index-1]._key, self._table[index-1]._value)
+        i, j = self._find_index(k)
+        if j > 0:
+            return self._item(i, j - 1)
+        if i > 0:
+            return self._item(i - 1, -1)
         return None
 
     def find_gt(self, k):
         """Return the smallest item with key strictly larger than k."""
-
-        index = self._find_index(k, 0, len(self._table)-1)
-        if index == len(self._table):
+        i = bisect.bisect_right(self._maxes, k)
+        if i == len(self._maxes):
             return None
-        if self._table[index] == k:
-            return (self._table[index+1]._key, self._table[index+1]._value)
-        else:
-            return (self._table[index]._key, self._table[index]._value)
+        return self._item(i, bisect.bisect_right(self._keys[i], k))
 
     def find_range(self, start, stop):
         """Generates an iteration of (key, value) pairs for start <= key <
         stop.
         If start is None, iteration starts with minimum key in the map.
         If stop is None, iteration continues until the maximum key in the map."""
-
         if start is None:
-            j=0
+            i, j = 0, 0
         else:
-            j = self._find_index(start, 0, len(self._table)-1)
-        while j < len(self._table) and (stop is None or self._table[j]._key <
-                stop):
-            yield (self._table[j]._key, self._table[j]._value)
-            j += 1
+            i, j = self._find_index(start)
+        yield from self._items_from(i, j, stop)
 
     def find_all(self, k):
         """Generates an iteration of all items with key == k."""
-        j = self._find_index(k, 0 , len(self._table)-1)
-        while j < len(self._table) and self._table[j]._key == k:
-            yield (self._table[j]._key, self._table[j]._value)
-            j += 1
+        i, j = self._find_index(k)
+        if i < len(self._keys) and self._keys[i][j] == k:
+            yield self._item(i, j)
+
+    def rank(self, k):
+        """Returns the number of keys strictly less than k in O(log n)."""
+        i, j = self._find_index(k)
+        return self._offset(i) + j
+
+    def select(self, index):
+        """Returns the (key, value) pair at index in key order in O(log n).
+        Negative indices count from the end."""
+        if index < 0:
+            index += self._n
+        if not 0 <= index < self._n:
+            raise IndexError("Index out of range")
+        return self._item(*self._position(index))
+
+    def count_range(self, start, stop):
+        """Returns the number of keys with start <= key < stop in O(log n).
+        A start or stop of None leaves that end of the range open."""
+        lo = 0 if start is None else self.rank(start)
+        hi = self._n if stop is None else self.rank(stop)
+        return max(0, hi - lo)
+
+    def slice_range(self, start, stop):
+        """Returns a RangeView of the items with start <= key < stop, found in
+        O(log n) without copying them. A start or stop of None leaves that end
+        of the range open."""
+        lo = 0 if start is None else self.rank(start)
+        hi = self._n if stop is None else self.rank(stop)
+        return self.RangeView(self, lo, hi)
+
+class NumericSortedTableMap(MapBase):
+    """A sorted table map for numeric keys, with keys and values stored in
+    two parallel NumPy arrays.
+
+    Batch operations answer a whole array of queries with one searchsorted
+    call, and update_many merges a batch of m pairs into n stored ones in
+    O(n + m) array work. Single-key insertions and deletions copy both
+    arrays, so load data with update_many. find_range returns array views
+    rather than an iteration of pairs. Requires NumPy."""
+
+    #Non-public behaviours
+    def _as_values(self, values, count):
+        if isinstance(values, np.ndarray) or self._value_dtype != np.dtype(object):
+            return np.asarray(values, dtype=self._value_dtype)
+        #Build object arrays element-wise, so tuple values stay scalars.
+        return np.fromiter(values, dtype=object, count=count)
+
+    def _as_keys(self, keys):
+        """Returns keys as an array of the key dtype. Raises ValueError if a
+        key would change in the cast, e.g. 10.5 in an int map."""
+        keys = np.asarray(keys)
+        if keys.dtype == self._keys.dtype:
+            return keys
+        with np.errstate(invalid='ignore'):
+            cast = keys.astype(self._keys.dtype)
+        if not np.array_equal(cast, keys):
+            raise ValueError("Keys cannot be stored as " + str(self._keys.dtype))
+        return cast
+
+    def _locate(self, k):
+        """Returns the index of k, or None if k is not in the map."""
+        i = int(np.searchsorted(self._keys, k))
+        if i < len(self._keys) and self._keys[i] == k:
+            return i
+        return None
+
+    def _item(self, i):
+        return (self._keys[i].item(), self._values[i])
+
+    #Public behaviours
+    def __init__(self, key_dtype='int64', value_dtype=object):
+        if np is None:
+            raise ImportError("NumericSortedTableMap requires NumPy")
+        self._value_dtype = np.dtype(value_dtype)
+        self._keys = np.empty(0, dtype=key_dtype)
+        self._values = np.empty(0, dtype=self._value_dtype)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __getitem__(self, k):
+        i = self._locate(k)
+        if i is None:
+            raise KeyError("Key error: " + repr(k))
+        return self._values[i]
+
+    def __setitem__(self, k, v):
+        i = int(np.searchsorted(self._keys, k))
+        if i < len(self._keys) and self._keys[i] == k:
+            self._values[i] = v
+        else:
+            self._keys = np.insert(self._keys, i, self._as_keys([k]))
+            self._values = np.insert(self._values, i, self._as_values([v], 1))
+
+    def __delitem__(self, k):
+        i = self._locate(k)
+        if i is None:
+            raise KeyError("Key error: " + repr(k))
+        self._keys = np.delete(self._keys, i)
+        self._values = np.delete(self._values, i)
+
+    def __iter__(self):
+        yield from self._keys.tolist()
+
+    def items(self):
+        """Generates an iteration of (key, value) pairs in key order."""
+        yield from zip(self._keys.tolist(), self._values)
+
+    def update_many(self, keys, values):
+        """Sets keys[i] to values[i] for every i. If a key repeats in the
+        batch its last value wins. The batch is sorted and merged with the
+        stored arrays in one pass instead of being inserted key by key."""
+        keys = self._as_keys(keys)
+        values = self._as_values(values, len(keys))
+        order = np.argsort(keys, kind='stable')
+        keys, values = keys[order], values[order]
+        if len(keys):
+            last = np.ones(len(keys), dtype=bool)
+            last[:-1] = keys[1:] != keys[:-1]
+            keys, values = keys[last], values[last]
+        pos = np.searchsorted(self._keys, keys)
+        found = pos < len(self._keys)
+        found[found] = self._keys[pos[found]] == keys[found]
+        self._values[pos[found]] = values[found]
+        new = ~found
+        if not new.any():
+            return
+        pos, keys, values = pos[new], keys[new], values[new]
+        #Each new key lands after the stored keys before it and the new keys
+        #already placed, the stored items fill the remaining slots in order.
+        slots = pos + np.arange(len(pos))
+        size = len(self._keys) + len(keys)
+        old = np.ones(size, dtype=bool)
+        old[slots] = False
+        merged_keys = np.empty(size, dtype=self._keys.dtype)
+        merged_values = np.empty(size, dtype=self._value_dtype)
+        merged_keys[slots] = keys
+        merged_values[slots] = values
+        merged_keys[old] = self._keys
+        merged_values[old] = self._values
+        self._keys, self._values = merged_keys, merged_values
+
+    def get_many(self, keys, default=None):
+        """Returns an array of the values of keys, default for missing ones,
+        from a single searchsorted call. Keys are compared without casting
+        them to the key dtype, as in get."""
+        keys = np.asarray(keys)
+        if not len(self._keys):
+            return np.full(len(keys), default)
+        pos = np.searchsorted(self._keys, keys)
+        clipped = np.minimum(pos, len(self._keys) - 1)
+        found = self._keys[clipped] == keys
+        return np.where(found, self._values[clipped], default)
+
+    def find_ge_many(self, keys):
+        """For every key of keys, finds the smallest stored key greater than
+        or equal to it. Returns three arrays: those keys, their values, and a
+        mask that is False where no such key exists, and where the first two
+        hold no meaningful entry. Keys are compared without casting them to
+        the key dtype, as in find_ge."""
+        keys = np.asarray(keys)
+        pos = np.searchsorted(self._keys, keys)
+        found = pos < len(self._keys)
+        if not len(self._keys):
+            return (np.empty(len(keys), dtype=self._keys.dtype),
+                    np.empty(len(keys), dtype=self._value_dtype), found)
+        clipped = np.minimum(pos, len(self._keys) - 1)
+        return (self._keys[clipped], self._values[clipped], found)
+
+    def find_range(self, start, stop):
+        """Returns views of the key and value arrays for start <= key < stop.
+        A start or stop of None leaves that end of the range open. The views
+        share memory with the map and are only valid until it is modified."""
+        lo = 0 if start is None else int(np.searchsorted(self._keys, start))
+        hi = len(self._keys) if stop is None else int(np.searchsorted(self._keys, stop))
+        hi = max(lo, hi)
+        return (self._keys[lo:hi], self._values[lo:hi])
+
+    def find_min(self):
+        if len(self._keys):
+            return self._item(0)
+        return None
+
+    def find_max(self):
+        if len(self._keys):
+            return self._item(-1)
+        return None
+
+    def find_ge(self, k):
+        """Return the smallest item with key greater than or equal to k."""
+        i = int(np.searchsorted(self._keys, k))
+        if i == len(self._keys):
+            return None
+        return self._item(i)
+
+    def find_lt(self, k):
+        """Return the largest item with key stricly less than k."""
+        i = int(np.searchsorted(self._keys, k))
+        if i > 0:
+            return self._item(i - 1)
+        return None
+
+    def find_gt(self, k):
+        """Return the smallest item with key strictly larger than k."""
+        i = int(np.searchsorted(self._keys, k, side='right'))
+        if i == len(self._keys):
+            return None
+        return self._item(i)
+
+def benchmark_resize(n=200000, map_class=None):
+    """Inserts n keys into a map_class with stop-the-world and with
+    incremental resizing, timing every operation. Prints and returns the
+    worst-case and 99.9th percentile latency in seconds for each mode."""
+    if map_class is None:
+        map_class = ChainHashMap
+    results = {}
+    for incremental in (False, True):
+        m = map_class(incremental=incremental)
+        latencies = []
+        for k in range(n):
+            start = time.perf_counter()
+            m[k] = k
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        mode = 'incremental' if incremental else 'stop-the-world'
+        results[mode] = (latencies[-1], latencies[int(len(latencies) * 0.999)])
+        print("%-15s max %.6fs  p99.9 %.6fs" % ((mode,) + results[mode]))
+    return results
+
+def benchmark_sharded(threads=8, ops=20000, bits=4):
+    """Runs a mixed read/write workload from several threads against one
+    ChainHashMap behind a global lock and against a ShardedHashMap. Prints
+    and returns the throughput of both in operations per second."""
+    class _GlobalLockMap():
+        def __init__(self):
+            self._map = ChainHashMap()
+            self._lock = threading.Lock()
+        def __setitem__(self, k, v):
+            with self._lock:
+                self._map[k] = v
+        def get(self, k, d=None):
+            with self._lock:
+                return self._map.get(k, d)
+
+    def run(m):
+        def work(seed):
+            for i in range(ops):
+                k = (seed * ops + i) * 7919 % (threads * ops)
+                if i % 4:
+                    m.get(k)
+                else:
+                    m[k] = i
+        workers = [threading.Thread(target=work, args=(i,)) for i in range(threads)]
+        start = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        return threads * ops / (time.perf_counter() - start)
+
+    results = {'global': run(_GlobalLockMap()), 'sharded': run(ShardedHashMap(bits))}
+    for mode, rate in results.items():
+        print("%-8s %.0f ops/s" % (mode, rate))
+    return results
@@ -1,3 +1,13 @@
+import array
+import asyncio
+import itertools
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
 class PriorityQueueBase():
     class _Item():
         __slots__='_key','_value'
@@ -5,7 +15,7 @@ class PriorityQueueBase():
             self._key=k
             self._value=v
 
-        def __It__(self, other):
+        def __lt__(self, other):
             return self._key<other._key
 
     def _is_empty(self):
@@ -42,6 +52,41 @@ class UnsortedPriorityQueue(PriorityQueueBase):
         item=self._data.delete(p)
         return (item._key, item._value)
 
+class SortedArrayPQ(PriorityQueueBase):
+    """A priority queue kept as parallel arrays of keys and values sorted in
+    decreasing key order, so the minimum is always at the end. add is a
+    binary search plus an O(n) insert, which is the fastest option for tiny
+    queues. Entries with equal keys are removed in insertion order."""
+
+    def __init__(self):
+        self._keys=[]
+        self._values=[]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, k, v):
+        #Binary search for the first index whose key is not larger than k.
+        low, high = 0, len(self._keys)
+        while low<high:
+            mid=(low+high)//2
+            if not k<self._keys[mid]:
+                high=mid
+            else:
+                low=mid+1
+        self._keys.insert(low, k)
+        self._values.insert(low, v)
+
+    def min(self):
+        if self._is_empty():
+            raise ValueError("Priority queue is empty.")
+        return (self._keys[-1], self._values[-1])
+
+    def remove_min(self):
+        if self._is_empty():
+            raise ValueError("Priority queue is empty.")
+        return (self._keys.pop(), self._values.pop())
+
 class HeapPQ(PriorityQueueBase):
     #Non-public behaviours
     def _parent(self, j):
@@ -64,7 +109,7 @@ class HeapPQ(PriorityQueueBase):
 
     def _heap_up(self, j):
         parent=self._parent(j)
-        if j>0 and self._data[j]>self._data[parent]:
+        if j>0 and self._data[j]<self._data[parent]:
             self._swap(j, parent)
             self._heap_up(parent)
 
@@ -73,17 +118,23 @@ class HeapPQ(PriorityQueueBase):
             child=self._left(j)
             if self._has_right(j):
                 right_child=self._right(j)
-                child = right_child if right_child<left_child
+                child = right_child if self._data[right_child]<self._data[child] else child
             if self._data[j]>self._data[child]:
                 self._swap(j, child)
                 self._heap_down(child)
 
     #Public behaviours
     def __init__(self, contents=()):
-        self._data=[self._Item(k,v) for k,v in content]
+        self._data=[self._Item(k,v) for k,v in contents]
         if len(self._data)>1:
             self._heapify()
 
+    @classmethod
+    def from_pairs(cls, pairs):
+        """Builds a heap from an iterable of (key, value) pairs in O(n) time
+        with a bottom-up heapify."""
+        return cls(pairs)
+
     def __len__(self):
         return len(self._data)
 
@@ -112,7 +163,7 @@ class HeapPQ(PriorityQueueBase):
             self._heap_down(j)
 
     def pushpop(self, k, v):
-        if self._is_empty:
+        if self._is_empty():
             raise ValueError("Heap is empty.")
         min_entry=self._data[0]
         if k<min_entry._key:
@@ -122,10 +173,999 @@ class HeapPQ(PriorityQueueBase):
         return (min_entry._key, min_entry._value)
 
     def heapreplace(self, k ,v):
-        if self._is_empty:
+        if self._is_empty():
             raise ValueError("Heap is empty.")
         min_entry=self._data[0]
         self._data[0]=self._Item(k,v)
         self._heap_down(0)
         return (min_entry._key, min_entry._value)
 
+    def push_many(self, pairs):
+        """Adds every (key, value) pair of the iterable. Large batches are
+        appended and the whole heap rebuilt in O(n+m), small ones are sifted
+        up one at a time in O(m log(n+m))."""
+        items=[self._Item(k,v) for k,v in pairs]
+        n=len(self._data)+len(items)
+        if len(items)*n.bit_length()>2*n:
+            self._data.extend(items)
+            self._heapify()
+        else:
+            for item in items:
+                self._data.append(item)
+                self._heap_up(len(self._data)-1)
+
+    def pop_many(self, k):
+        """Removes and returns the (key, value) pairs of the k smallest
+        entries, in increasing key order."""
+        return [self.remove_min() for _ in range(min(k, len(self._data)))]
+
+class AdaptableHeapPQ(HeapPQ):
+    """A heap-based priority queue whose entries can be updated or removed in
+    O(log n) through the locator returned by add. Every entry is a Locator,
+    including those created by the inherited bulk methods."""
+    class Locator(HeapPQ._Item):
+        """Token for an entry, which also records its index in the heap."""
+        __slots__ = '_index'
+
+        def __init__(self, k, v, j=-1):
+            super().__init__(k, v)
+            self._index = j
+
+    _Item = Locator
+
+    #Non-public behaviours
+    def _swap(self, a, b):
+        super()._swap(a, b)
+        self._data[a]._index = a
+        self._data[b]._index = b
+
+    def _heap_up(self, j):
+        self._data[j]._index = j
+        super()._heap_up(j)
+
+    def _heap_down(self, j):
+        if j<len(self._data):
+            self._data[j]._index = j
+        super()._heap_down(j)
+
+    def _heapify(self):
+        for j, loc in enumerate(self._data):
+            loc._index = j
+        super()._heapify()
+
+    def _bubble(self, j):
+        """Restores the heap order after the key at index j changed."""
+        if j>0 and self._data[j]<self._data[self._parent(j)]:
+            self._heap_up(j)
+        else:
+            self._heap_down(j)
+
+    def _validate(self, loc):
+        """Returns the index of loc. Raises ValueError if loc is not a live
+        locator of this queue."""
+        j = loc._index
+        if not (0 <= j < len(self._data) and self._data[j] is loc):
+            raise ValueError("Invalid locator.")
+        return j
+
+    #Public behaviours
+    def __init__(self, contents=()):
+        super().__init__(contents)
+        if len(self._data)==1:
+            self._data[0]._index=0
+
+    def add(self, k, v):
+        """Adds an entry and returns a locator for it."""
+        token=self.Locator(k, v, len(self._data))
+        self._data.append(token)
+        self._heap_up(len(self._data)-1)
+        return token
+
+    def update(self, loc, k, v):
+        """Replaces the key and value of the entry identified by loc."""
+        j=self._validate(loc)
+        loc._key=k
+        loc._value=v
+        self._bubble(j)
+
+    def remove(self, loc):
+        """Removes the entry identified by loc and returns its (key, value)."""
+        j=self._validate(loc)
+        if j==len(self._data)-1:
+            self._data.pop()
+        else:
+            self._swap(j, len(self._data)-1)
+            self._data.pop()
+            self._bubble(j)
+        loc._index=-1
+        return (loc._key, loc._value)
+
+class CompactHeapPQ(PriorityQueueBase):
+    """A d-ary min-heap that stores keys and values in two parallel arrays
+    instead of one _Item per entry, and sifts with iterative loops. If
+    typecode is given, keys are kept in an array.array of that type."""
+
+    #Non-public behaviours
+    def _sift_up(self, j, k, v):
+        """Moves the hole at j up until (k, v) can be stored in it."""
+        keys, values, d = self._keys, self._values, self._d
+        while j > 0:
+            parent = (j-1)//d
+            parent_key = keys[parent]
+            if not k < parent_key:
+                break
+            keys[j] = parent_key
+            values[j] = values[parent]
+            j = parent
+        keys[j] = k
+        values[j] = v
+
+    def _sift_down(self, j, k, v):
+        """Moves the hole at j down until (k, v) can be stored in it."""
+        keys, values, d = self._keys, self._values, self._d
+        n = len(keys)
+        while True:
+            first = d*j+1
+            if first >= n:
+                break
+            child = first
+            child_key = keys[first]
+            for c in range(first+1, min(first+d, n)):
+                if keys[c] < child_key:
+                    child = c
+                    child_key = keys[c]
+            if not child_key < k:
+                break
+            keys[j] = child_key
+            values[j] = values[child]
+            j = child
+        keys[j] = k
+        values[j] = v
+
+    #Public behaviours
+    def __init__(self, d=4, typecode=None):
+        if d < 2:
+            raise ValueError("Heap arity must be at least 2.")
+        self._d = d
+        self._keys = array.array(typecode) if typecode else []
+        self._values = []
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, k, v):
+        self._keys.append(k)
+        self._values.append(v)
+        self._sift_up(len(self._keys)-1, k, v)
+
+    def min(self):
+        if self._is_empty():
+            raise ValueError("Heap is empty.")
+        return (self._keys[0], self._values[0])
+
+    def remove_min(self):
+        if self._is_empty():
+            raise ValueError("Heap is empty.")
+        min_entry = (self._keys[0], self._values[0])
+        k = self._keys.pop()
+        v = self._values.pop()
+        if self._keys:
+            self._sift_down(0, k, v)
+        return min_entry
+
+class RadixHeap(PriorityQueueBase):
+    """A monotone priority queue for integer keys. Keys may never be smaller
+    than start or than the last minimum found by min or remove_min, which
+    lets entries be kept in buckets by the highest bit in which they differ
+    from that key: add is O(1) and remove_min is amortized O(log C) for keys
+    spanning a range of C. Keys are bucketed relative to start, so start and
+    the keys may be negative."""
+
+    #Non-public behaviours
+    def _bucket(self, k):
+        #XOR only orders non-negative ints, and no key is below start.
+        return ((k-self._start) ^ (self._last-self._start)).bit_length()
+
+    def _refill(self):
+        """Ensures bucket 0 holds the entries with the minimum key by
+        redistributing the first non-empty bucket around its minimum."""
+        if self._buckets[0]:
+            return
+        if self._is_empty():
+            raise ValueError("Priority queue is empty.")
+        i=1
+        while not self._buckets[i]:
+            i+=1
+        entries=self._buckets[i]
+        self._buckets[i]=[]
+        self._last=min(entry[0] for entry in entries)
+        for entry in entries:
+            self._buckets[self._bucket(entry[0])].append(entry)
+
+    #Public behaviours
+    def __init__(self, start=0):
+        self._start=start
+        self._last=start
+        self._buckets=[[]]
+        self._size=0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, k, v):
+        if k<self._last:
+            raise ValueError("Key is smaller than the last minimum found.")
+        j=self._bucket(k)
+        while j>=len(self._buckets):
+            self._buckets.append([])
+        self._buckets[j].append((k, v))
+        self._size+=1
+
+    def min(self):
+        self._refill()
+        return self._buckets[0][-1]
+
+    def remove_min(self):
+        self._refill()
+        self._size-=1
+        return self._buckets[0].pop()
+
+class BucketQueue(PriorityQueueBase):
+    """A priority queue for integer keys in the range [low, high], with one
+    bucket per key. add is O(1) and remove_min scans forward from the
+    smallest key seen, which is amortized O(1) when keys are removed in
+    monotone order, as in Dijkstra's algorithm with small integer weights."""
+
+    def __init__(self, high, low=0):
+        self._low=low
+        self._buckets=[[] for _ in range(high-low+1)]
+        self._cursor=len(self._buckets)
+        self._size=0
+
+    def __len__(self):
+        return self._size
+
+    def _find_min(self):
+        """Advances the cursor to the first non-empty bucket."""
+        if self._is_empty():
+            raise ValueError("Priority queue is empty.")
+        while not self._buckets[self._cursor]:
+            self._cursor+=1
+        return self._cursor
+
+    def add(self, k, v):
+        j=k-self._low
+        if not 0<=j<len(self._buckets):
+            raise ValueError("Key is outside the range of the queue.")
+        self._buckets[j].append(v)
+        self._size+=1
+        if j<self._cursor:
+            self._cursor=j
+
+    def min(self):
+        j=self._find_min()
+        return (j+self._low, self._buckets[j][-1])
+
+    def remove_min(self):
+        j=self._find_min()
+        self._size-=1
+        return (j+self._low, self._buckets[j].pop())
+
+class PairingHeap(PriorityQueueBase):
+    """A pairing heap: a multiway tree with the minimum at the root. add and
+    meld are O(1), and remove_min is amortized O(log n) using the two-pass
+    pairing of the root's children. add returns the entry's node as a
+    handle for decrease_key and remove. Handles stay valid when their heap
+    is melded into another one, and are rejected by any other heap."""
+    class _Owner():
+        """Ownership token of a heap. meld forwards the melded heap's token
+        to the receiving heap's, so nodes need not be visited."""
+        __slots__ = '_forward'
+
+        def __init__(self):
+            self._forward=None
+
+    class _Node(PriorityQueueBase._Item):
+        """Tree node; _prev is the parent for a leftmost child, otherwise the
+        left sibling."""
+        __slots__ = '_child', '_next', '_prev', '_owner'
+
+        def __init__(self, k, v, owner):
+            super().__init__(k, v)
+            self._child=None
+            self._next=None
+            self._prev=None
+            self._owner=owner
+
+    #Non-public behaviours
+    def _link(self, a, b):
+        """Makes the root with the larger key the leftmost child of the other
+        and returns the new root."""
+        if b._key<a._key:
+            a, b = b, a
+        b._prev=a
+        b._next=a._child
+        if a._child is not None:
+            a._child._prev=b
+        a._child=b
+        return a
+
+    def _merge_pairs(self, first):
+        """Links the sibling list starting at first into a single tree, first
+        pairwise from left to right and then right to left."""
+        pairs=[]
+        while first is not None:
+            a=first
+            b=a._next
+            a._prev=a._next=None
+            if b is None:
+                pairs.append(a)
+                break
+            first=b._next
+            b._prev=b._next=None
+            pairs.append(self._link(a, b))
+        root=pairs.pop() if pairs else None
+        while pairs:
+            root=self._link(pairs.pop(), root)
+        return root
+
+    def _cut(self, node):
+        """Detaches the subtree rooted at node from its parent."""
+        if node._prev._child is node:
+            node._prev._child=node._next
+        else:
+            node._prev._next=node._next
+        if node._next is not None:
+            node._next._prev=node._prev
+        node._prev=node._next=None
+
+    def _resolve(self, owner):
+        """Follows the forwarding chain of owner to the live token, and
+        points every token on the way straight at it."""
+        root=owner
+        while root._forward is not None:
+            root=root._forward
+        while owner is not root and owner._forward is not root:
+            owner._forward, owner = root, owner._forward
+        return root
+
+    def _validate(self, node):
+        if not isinstance(node, self._Node) or node._next is node:
+            raise ValueError("Invalid handle.")
+        node._owner=self._resolve(node._owner)
+        if node._owner is not self._owner:
+            raise ValueError("Handle belongs to another heap.")
+
+    def _discard(self, node):
+        """Detaches the removed root node and marks it as a dead handle."""
+        node._child=None
+        node._next=node
+        self._size-=1
+
+    #Public behaviours
+    def __init__(self):
+        self._root=None
+        self._size=0
+        self._owner=self._Owner()
+
+    def __len__(self):
+        return self._size
+
+    def add(self, k, v):
+        """Adds an entry in O(1) and returns a handle for it."""
+        node=self._Node(k, v, self._owner)
+        self._root=node if self._root is None else self._link(self._root, node)
+        self._size+=1
+        return node
+
+    def min(self):
+        if self._is_empty():
+            raise ValueError("Heap is empty.")
+        return (self._root._key, self._root._value)
+
+    def remove_min(self):
+        if self._is_empty():
+            raise ValueError("Heap is empty.")
+        root=self._root
+        self._root=self._merge_pairs(root._child)
+        self._discard(root)
+        return (root._key, root._value)
+
+    def meld(self, other):
+        """Moves every entry of the PairingHeap other into this one in O(1),
+        leaving other empty."""
+        if other is self:
+            raise ValueError("Cannot meld a heap with itself.")
+        if other._root is not None:
+            self._root=other._root if self._root is None else \
+                self._link(self._root, other._root)
+            self._size+=other._size
+        other._root=None
+        other._size=0
+        #other's nodes now belong here, and other starts over with a new token.
+        other._owner._forward=self._owner
+        other._owner=self._Owner()
+
+    def decrease_key(self, node, k):
+        """Lowers the key of the entry with handle node to k."""
+        self._validate(node)
+        if node._key<k:
+            raise ValueError("New key is larger than the current key.")
+        node._key=k
+        if node is not self._root:
+            self._cut(node)
+            self._root=self._link(self._root, node)
+
+    def remove(self, node):
+        """Removes the entry with handle node and returns its (key, value)."""
+        self._validate(node)
+        if node is self._root:
+            return self.remove_min()
+        self._cut(node)
+        subtree=self._merge_pairs(node._child)
+        if subtree is not None:
+            self._root=self._link(self._root, subtree)
+        self._discard(node)
+        return (node._key, node._value)
+
+class AdaptivePQ(PriorityQueueBase):
+    """A priority queue that switches representation as it grows and
+    shrinks: a SortedArrayPQ while it holds at most small entries, a
+    CompactHeapPQ beyond that, and a RadixHeap once it holds more than large
+    entries if every key so far has been an int no smaller than the last
+    minimum removed. It demotes again when it shrinks to a quarter of the
+    threshold, or from RadixHeap to heap when a smaller key arrives. The
+    number of operations served by each representation and the number of
+    switches are kept in counters()."""
+
+    #Non-public behaviours
+    def _switch(self, kind):
+        """Moves every entry into a new representation of the given kind."""
+        entries=[]
+        while len(self._queue):
+            entries.append(self._queue.remove_min())
+        if kind=='sorted':
+            self._queue=SortedArrayPQ()
+            self._queue._keys=[k for k, _ in reversed(entries)]
+            self._queue._values=[v for _, v in reversed(entries)]
+        elif kind=='heap':
+            #An array sorted by key is already a valid heap.
+            self._queue=CompactHeapPQ()
+            self._queue._keys=[k for k, _ in entries]
+            self._queue._values=[v for _, v in entries]
+        else:
+            #The last key removed is no larger than any key still queued.
+            start=self._last if self._last is not None else entries[0][0]
+            self._queue=RadixHeap(start)
+            for k, v in entries:
+                self._queue.add(k, v)
+        self._kind=kind
+        self._counters['switches']+=1
+
+    def _check_size(self):
+        n=len(self._queue)
+        if self._kind=='sorted':
+            if n>self._small:
+                self._switch('heap')
+        elif n<self._small//4:
+            self._monotone=True
+            self._switch('sorted')
+        elif self._kind=='heap' and n>self._large and self._monotone:
+            self._switch('radix')
+
+    #Public behaviours
+    def __init__(self, small=32, large=4096):
+        self._small=small
+        self._large=large
+        self._queue=SortedArrayPQ()
+        self._kind='sorted'
+        self._monotone=True
+        self._last=None
+        self._counters={'sorted': 0, 'heap': 0, 'radix': 0, 'switches': 0}
+
+    def __len__(self):
+        return len(self._queue)
+
+    def representation(self):
+        """Returns 'sorted', 'heap' or 'radix'."""
+        return self._kind
+
+    def counters(self):
+        """Returns the operations served by each representation and the number
+        of representation switches."""
+        return dict(self._counters)
+
+    def add(self, k, v):
+        #A RadixHeap's bound rises with min() too, so check against its own.
+        floor=self._queue._last if self._kind=='radix' else self._last
+        if self._monotone and (type(k) is not int or
+                               (floor is not None and k<floor)):
+            self._monotone=False
+            if self._kind=='radix':
+                self._switch('heap')
+        self._counters[self._kind]+=1
+        self._queue.add(k, v)
+        self._check_size()
+
+    def min(self):
+        self._counters[self._kind]+=1
+        return self._queue.min()
+
+    def remove_min(self):
+        self._counters[self._kind]+=1
+        entry=self._queue.remove_min()
+        self._last=entry[0]
+        self._check_size()
+        return entry
+
+class DurableHeapPQ(PriorityQueueBase):
+    """A persistent binary min-heap of fixed-size (key, value) records.
+
+    The heap array lives in a memory-mapped file at path + '.heap', off the
+    Python heap. Every add and remove_min is also appended to a write-ahead
+    log at path + '.wal'; log records are buffered and made durable in
+    groups of group_size by commit(), which fsyncs once per group.
+    checkpoint() copies the heap to path + '.snap' and truncates the log.
+    Checkpoints are numbered: the log starts with the number of the last
+    checkpoint it follows and the snapshot records its own, so a log that
+    is older than the snapshot, left by a crash during checkpoint(), is
+    recognised and never replayed twice.
+
+    After a clean close() the heap file is reused as is, so reopening is
+    instant. After a crash the heap file cannot be trusted, so the queue is
+    rebuilt from the last snapshot by replaying the committed log records.
+    Operations that were not yet committed are lost.
+
+    key_format and value_format are struct codes, e.g. 'd' for float keys
+    and 'q' for 64-bit integer job ids."""
+
+    _MAGIC = b'DHEAPv2\0'
+    _HEADER = struct.Struct('<8sQBQ')
+    _WAL_HEADER = struct.Struct('<Q')
+    _HEADER_SIZE = 32
+
+    #Non-public behaviours
+    def _map(self, capacity):
+        """(Re)maps the heap file with room for capacity records."""
+        if self._mm is not None:
+            self._mm.close()
+        self._heap_file.truncate(self._HEADER_SIZE+capacity*self._record.size)
+        self._mm=mmap.mmap(self._heap_file.fileno(), 0)
+        self._capacity=capacity
+
+    def _write_header(self, clean):
+        self._HEADER.pack_into(self._mm, 0, self._MAGIC, self._n, clean,
+                               self._generation)
+
+    def _reset_wal(self):
+        """Empties the log and starts it with the current generation."""
+        self._wal.truncate(0)
+        self._wal.write(self._WAL_HEADER.pack(self._generation))
+        self._wal.flush()
+        os.fsync(self._wal.fileno())
+
+    def _get(self, j):
+        return self._record.unpack_from(self._mm,
+                                        self._HEADER_SIZE+j*self._record.size)
+
+    def _put(self, j, k, v):
+        self._record.pack_into(self._mm, self._HEADER_SIZE+j*self._record.size,
+                               k, v)
+
+    def _heap_add(self, k, v):
+        if self._n==self._capacity:
+            self._map(2*self._capacity)
+        j=self._n
+        self._n+=1
+        while j>0:
+            parent=(j-1)//2
+            parent_entry=self._get(parent)
+            if not k<parent_entry[0]:
+                break
+            self._put(j, *parent_entry)
+            j=parent
+        self._put(j, k, v)
+
+    def _heap_remove_min(self):
+        if self._n==0:
+            raise ValueError("Heap is empty.")
+        min_entry=self._get(0)
+        self._n-=1
+        if self._n:
+            k, v = self._get(self._n)
+            j=0
+            while 2*j+1<self._n:
+                child=2*j+1
+                child_entry=self._get(child)
+                if child+1<self._n:
+                    right_entry=self._get(child+1)
+                    if right_entry[0]<child_entry[0]:
+                        child, child_entry = child+1, right_entry
+                if not child_entry[0]<k:
+                    break
+                self._put(j, *child_entry)
+                j=child
+            self._put(j, k, v)
+        return min_entry
+
+    def _log(self, op, k, v):
+        self._pending.extend(self._wal_record.pack(op, k, v))
+        self._pending_ops+=1
+        if self._pending_ops>=self._group_size:
+            self.commit()
+
+    def _recover(self):
+        """Rebuilds the heap from the snapshot and the committed log."""
+        self._n=0
+        snap_generation=0
+        if os.path.exists(self._path+'.snap'):
+            with open(self._path+'.snap', 'rb') as snap:
+                data=snap.read()
+            magic, n, _, snap_generation = self._HEADER.unpack_from(data, 0)
+            if magic!=self._MAGIC:
+                raise ValueError("Corrupt snapshot file.")
+            if n>self._capacity:
+                self._map(n)
+            size=n*self._record.size
+            self._mm[self._HEADER_SIZE:self._HEADER_SIZE+size]= \
+                data[self._HEADER_SIZE:self._HEADER_SIZE+size]
+            self._n=n
+        self._generation=snap_generation
+        self._wal.seek(0)
+        log=self._wal.read()
+        header=self._WAL_HEADER.size
+        #A log older than the snapshot is already part of it: checkpoint()
+        #was interrupted before it could reset the log.
+        if len(log)<header or \
+                self._WAL_HEADER.unpack_from(log)[0]<snap_generation:
+            log=b''
+        else:
+            log=log[header:]
+        #A torn record at the end of the log was never committed.
+        complete=len(log)-len(log)%self._wal_record.size
+        for op, k, v in self._wal_record.iter_unpack(log[:complete]):
+            if op==b'A':
+                self._heap_add(k, v)
+            else:
+                self._heap_remove_min()
+        self.checkpoint()
+
+    #Public behaviours
+    def __init__(self, path, key_format='d', value_format='q', group_size=64,
+            capacity=1024):
+        self._path=path
+        self._record=struct.Struct('<'+key_format+value_format)
+        self._wal_record=struct.Struct('<c'+key_format+value_format)
+        self._group_size=group_size
+        self._pending=bytearray()
+        self._pending_ops=0
+        self._mm=None
+        exists=os.path.exists(path+'.heap')
+        self._heap_file=open(path+'.heap', 'r+b' if exists else 'w+b')
+        self._wal=open(path+'.wal', 'a+b')
+        clean=False
+        self._n=0
+        self._generation=0
+        if exists and os.path.getsize(path+'.heap')>=self._HEADER_SIZE:
+            self._heap_file.seek(0)
+            magic, n, clean, generation = self._HEADER.unpack(
+                self._heap_file.read(self._HEADER.size))
+            if magic!=self._MAGIC:
+                raise ValueError("Not a DurableHeapPQ file: "+repr(path))
+            self._n=n
+            self._generation=generation
+        self._map(max(capacity, self._n, 1))
+        if not clean:
+            self._recover()
+        #Stay marked as dirty until close(), so a crash triggers recovery.
+        self._write_header(0)
+        self._mm.flush()
+
+    def __len__(self):
+        return self._n
+
+    def add(self, k, v):
+        self._log(b'A', k, v)
+        self._heap_add(k, v)
+
+    def min(self):
+        if self._n==0:
+            raise ValueError("Heap is empty.")
+        return self._get(0)
+
+    def remove_min(self):
+        if self._n==0:
+            raise ValueError("Heap is empty.")
+        self._log(b'R', 0, 0)
+        return self._heap_remove_min()
+
+    def commit(self):
+        """Writes the buffered log records and fsyncs the log once."""
+        if self._pending:
+            self._wal.write(self._pending)
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+            self._pending=bytearray()
+            self._pending_ops=0
+
+    def checkpoint(self):
+        """Snapshots the heap so that the log can be truncated."""
+        self.commit()
+        self._generation+=1
+        self._write_header(0)
+        self._mm.flush()
+        size=self._HEADER_SIZE+self._n*self._record.size
+        with open(self._path+'.snap.tmp', 'wb') as snap:
+            snap.write(self._mm[:size])
+            snap.flush()
+            os.fsync(snap.fileno())
+        os.replace(self._path+'.snap.tmp', self._path+'.snap')
+        self._reset_wal()
+
+    def close(self):
+        """Checkpoints and marks the heap file clean for instant reopening."""
+        self.checkpoint()
+        self._write_header(1)
+        self._mm.flush()
+        self._mm.close()
+        self._heap_file.close()
+        self._wal.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class _MaxHeapPQ(HeapPQ):
+    """Utility heap for nsmallest that keeps the largest key on top."""
+    class _Item(HeapPQ._Item):
+        __slots__ = ()
+
+        def __lt__(self, other):
+            return other._key<self._key
+
+def nsmallest(k, pairs):
+    """Returns the k (key, value) pairs with the smallest keys from the
+    iterable pairs, in increasing key order. Only k entries are kept in
+    memory, in a max-heap whose top is the one to evict next."""
+    if k<=0:
+        return []
+    pairs=iter(pairs)
+    heap=_MaxHeapPQ.from_pairs(itertools.islice(pairs, k))
+    for key, value in pairs:
+        if key<heap._data[0]._key:
+            heap._data[0]=heap._Item(key, value)
+            heap._heap_down(0)
+    result=heap.pop_many(len(heap))
+    result.reverse()
+    return result
+
+class TopK():
+    """Accumulates the k items with the largest keys of a stream in O(k)
+    memory. The items are kept in a bounded min-heap whose top is the
+    smallest item kept, so once k items have been seen pushpop rejects
+    most new ones with a single comparison."""
+
+    def __init__(self, k, key=None):
+        if k<1:
+            raise ValueError("k must be at least 1.")
+        self._k=k
+        self._key=key
+        self._heap=HeapPQ()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _push_keyed(self, k, item):
+        if len(self._heap)<self._k:
+            self._heap.add(k, item)
+        else:
+            self._heap.pushpop(k, item)
+
+    def push(self, item):
+        """Offers item to the accumulator."""
+        self._push_keyed(item if self._key is None else self._key(item), item)
+
+    def update(self, items):
+        """Offers every item of the iterable."""
+        for item in items:
+            self.push(item)
+
+    def merge(self, other):
+        """Folds the items kept by another TopK, e.g. from another shard, into
+        this one without recomputing their keys. Returns self."""
+        for entry in other._heap._data:
+            self._push_keyed(entry._key, entry._value)
+        return self
+
+    def min_key(self):
+        """Returns the smallest key kept, which a new item has to beat once
+        the accumulator is full."""
+        return self._heap.min()[0]
+
+    def items(self):
+        """Returns the kept items, largest key first."""
+        heap=HeapPQ((entry._key, entry._value) for entry in self._heap._data)
+        result=[item for _, item in heap.pop_many(len(heap))]
+        result.reverse()
+        return result
+
+class BlockingHeapPQ():
+    """Thread-safe priority queue over a HeapPQ. get blocks on a condition
+    variable until an entry is available, and put_many/get_many move whole
+    batches under a single lock acquisition."""
+
+    def __init__(self, contents=()):
+        self._heap=HeapPQ(contents)
+        self._lock=threading.Lock()
+        self._not_empty=threading.Condition(self._lock)
+        self._all_done=threading.Condition(self._lock)
+        self._unfinished=len(self._heap)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._heap)
+
+    def put(self, k, v):
+        with self._lock:
+            self._heap.add(k, v)
+            self._unfinished+=1
+            self._not_empty.notify()
+
+    def put_many(self, pairs):
+        """Adds every (key, value) pair of the iterable in one batch."""
+        pairs=list(pairs)
+        with self._lock:
+            self._heap.push_many(pairs)
+            self._unfinished+=len(pairs)
+            self._not_empty.notify(len(pairs))
+
+    def _wait(self, block, timeout):
+        """Waits with the lock held until the heap is non-empty. Raises
+        queue.Empty if it is still empty when block is False or after
+        timeout seconds."""
+        if not block:
+            if not len(self._heap):
+                raise queue.Empty
+        elif not self._not_empty.wait_for(lambda: len(self._heap), timeout):
+            raise queue.Empty
+
+    def get(self, block=True, timeout=None):
+        """Removes and returns the (key, value) pair with the smallest key."""
+        with self._lock:
+            self._wait(block, timeout)
+            return self._heap.remove_min()
+
+    def get_many(self, max_items, block=True, timeout=None):
+        """Waits for at least one entry like get, then removes and returns up
+        to max_items entries in increasing key order."""
+        with self._lock:
+            self._wait(block, timeout)
+            return self._heap.pop_many(max_items)
+
+    def task_done(self, n=1):
+        """Marks n previously fetched entries as processed."""
+        with self._lock:
+            if n>self._unfinished:
+                raise ValueError("task_done() called too many times.")
+            self._unfinished-=n
+            if not self._unfinished:
+                self._all_done.notify_all()
+
+    def join(self):
+        """Blocks until every entry put so far has been marked done."""
+        with self._lock:
+            self._all_done.wait_for(lambda: not self._unfinished)
+
+class AsyncHeapPQ():
+    """asyncio priority queue over a HeapPQ with the same interface as
+    BlockingHeapPQ, where get, get_many and join are coroutines."""
+
+    def __init__(self, contents=()):
+        self._heap=HeapPQ(contents)
+        self._not_empty=asyncio.Condition()
+        self._all_done=asyncio.Event()
+        self._unfinished=len(self._heap)
+        if not self._unfinished:
+            self._all_done.set()
+
+    def __len__(self):
+        return len(self._heap)
+
+    async def put(self, k, v):
+        async with self._not_empty:
+            self._heap.add(k, v)
+            self._unfinished+=1
+            self._all_done.clear()
+            self._not_empty.notify()
+
+    async def put_many(self, pairs):
+        """Adds every (key, value) pair of the iterable in one batch."""
+        pairs=list(pairs)
+        async with self._not_empty:
+            self._heap.push_many(pairs)
+            self._unfinished+=len(pairs)
+            if pairs:
+                self._all_done.clear()
+            self._not_empty.notify(len(pairs))
+
+    async def _wait(self, timeout):
+        """Waits with the condition held until the heap is non-empty. Raises
+        queue.Empty after timeout seconds."""
+        try:
+            await asyncio.wait_for(
+                self._not_empty.wait_for(lambda: len(self._heap)), timeout)
+        except asyncio.TimeoutError:
+            raise queue.Empty from None
+
+    async def get(self, timeout=None):
+        """Removes and returns the (key, value) pair with the smallest key."""
+        async with self._not_empty:
+            await self._wait(timeout)
+            return self._heap.remove_min()
+
+    async def get_many(self, max_items, timeout=None):
+        """Waits for at least one entry like get, then removes and returns up
+        to max_items entries in increasing key order."""
+        async with self._not_empty:
+            await self._wait(timeout)
+            return self._heap.pop_many(max_items)
+
+    def task_done(self, n=1):
+        """Marks n previously fetched entries as processed."""
+        if n>self._unfinished:
+            raise ValueError("task_done() called too many times.")
+        self._unfinished-=n
+        if not self._unfinished:
+            self._all_done.set()
+
+    async def join(self):
+        """Waits until every entry put so far has been marked done."""
+        await self._all_done.wait()
+
+def benchmark_contention(producers=8, consumers=4, items=20000, batch=64):
+    """Times BlockingHeapPQ with one lock acquisition per entry against
+    batched put_many/get_many under many producer and consumer threads.
+    Prints and returns the throughput of both modes in entries per second."""
+    def run(batched):
+        pq=BlockingHeapPQ()
+        stop=threading.Event()
+        per_producer=items//producers
+        total=per_producer*producers
+
+        def produce(seed):
+            keys=[(seed*per_producer+i)%997 for i in range(per_producer)]
+            if batched:
+                for start in range(0, per_producer, batch):
+                    pq.put_many((k, k) for k in keys[start:start+batch])
+            else:
+                for k in keys:
+                    pq.put(k, k)
+
+        def consume():
+            while not stop.is_set():
+                try:
+                    got=pq.get_many(batch, timeout=0.01) if batched \
+                        else [pq.get(timeout=0.01)]
+                except queue.Empty:
+                    continue
+                pq.task_done(len(got))
+
+        threads=[threading.Thread(target=produce, args=(i,))
+                 for i in range(producers)]
+        threads+=[threading.Thread(target=consume) for _ in range(consumers)]
+        start=time.perf_counter()
+        for t in threads:
+            t.start()
+        pq.join()
+        elapsed=time.perf_counter()-start
+        stop.set()
+        for t in threads:
+            t.join()
+        return total/elapsed
+
+    results={'single': run(False), 'batched': run(True)}
+    for mode, rate in results.items():
+        print("%-8s %.0f entries/s" % (mode, rate))
+    return results
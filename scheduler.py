@@ -0,0 +1,207 @@
+import math
+
+from priority_queues import HeapPQ
+
+class Timer():
+    """Handle for a job scheduled on a TimerWheel."""
+    __slots__ = '_deadline', '_tick', '_job', '_active'
+
+    def __init__(self, deadline, tick, job):
+        self._deadline = deadline
+        self._tick = tick
+        self._job = job
+        self._active = True
+
+    def deadline(self):
+        return self._deadline
+
+    def job(self):
+        return self._job
+
+    def is_active(self):
+        """Returns True if the timer has neither fired nor been cancelled."""
+        return self._active
+
+class TimerWheel():
+    """A hierarchical timing wheel for scheduling jobs by deadline.
+
+    Time is divided into ticks of the given resolution and deadlines are
+    rounded up to the next tick, so jobs never fire early. Each of the levels
+    holds 2**bits slots, level L covering 2**(bits*L) ticks per slot; timers
+    too far in the future for the top level wait in an overflow HeapPQ.
+    Scheduling is O(1) and cancellation only marks the timer, leaving a
+    tombstone that is dropped when its slot is reached. Tombstones are
+    compacted away once they outnumber live timers by compact_ratio, so
+    cancelled timers cannot pile up."""
+
+    #Non-public behaviours
+    def _to_tick(self, t):
+        return math.ceil(t / self._resolution)
+
+    def _place(self, timer):
+        """Stores timer in the slot matching its tick relative to the current
+        tick, or in the overflow heap if it is beyond the top level."""
+        tick = timer._tick
+        for level in range(self._levels):
+            shift = self._bits * (level + 1)
+            if tick >> shift == self._current >> shift:
+                slot = (tick >> (self._bits * level)) & self._mask
+                self._wheels[level][slot].append(timer)
+                self._counts[level] += 1
+                return
+        self._overflow.add(tick, timer)
+
+    def _cascade(self, level):
+        """Redistributes the current slot of level into the lower levels."""
+        slot = (self._current >> (self._bits * level)) & self._mask
+        timers = self._wheels[level][slot]
+        self._wheels[level][slot] = []
+        self._counts[level] -= len(timers)
+        for timer in timers:
+            if timer._active:
+                self._place(timer)
+            else:
+                self._tombstones -= 1
+
+    def _pull_overflow(self):
+        """Moves timers that now fit in the top level out of the overflow
+        heap."""
+        shift = self._bits * self._levels
+        prefix = self._current >> shift
+        while len(self._overflow) and self._overflow.min()[0] >> shift == prefix:
+            tick, timer = self._overflow.remove_min()
+            if timer._active:
+                self._place(timer)
+            else:
+                self._tombstones -= 1
+
+    def _advance(self):
+        """Moves the current tick forward by one, cascading every level whose
+        slot boundary was crossed, highest level first."""
+        self._current += 1
+        if self._current & self._mask:
+            return
+        if not self._current & ((1 << (self._bits * self._levels)) - 1):
+            self._pull_overflow()
+        for level in range(self._levels - 1, 0, -1):
+            if not self._current & ((1 << (self._bits * level)) - 1):
+                self._cascade(level)
+
+    def _fire(self, timers, due):
+        """Appends the (deadline, job) pairs of the active timers to due and
+        drops the tombstones."""
+        for timer in timers:
+            if timer._active:
+                timer._active = False
+                self._live -= 1
+                due.append((timer._deadline, timer._job))
+            else:
+                self._tombstones -= 1
+
+    def _compact(self):
+        """Removes every tombstone from the wheels and the overflow heap."""
+        self._overdue = [t for t in self._overdue if t._active]
+        for level, wheel in enumerate(self._wheels):
+            for slot in range(len(wheel)):
+                if wheel[slot]:
+                    wheel[slot] = [t for t in wheel[slot] if t._active]
+            self._counts[level] = sum(len(timers) for timers in wheel)
+        self._overflow = HeapPQ.from_pairs(
+            (item._key, item._value) for item in self._overflow._data
+            if item._value._active)
+        self._tombstones = 0
+
+    #Public behaviours
+    def __init__(self, resolution=1.0, bits=8, levels=3, start=0.0,
+            compact_ratio=1.0):
+        self._resolution = resolution
+        self._bits = bits
+        self._mask = (1 << bits) - 1
+        self._levels = levels
+        self._wheels = [[[] for _ in range(1 << bits)] for _ in range(levels)]
+        self._overflow = HeapPQ()
+        self._current = self._to_tick(start)
+        self._overdue = []
+        self._counts = [0] * levels
+        self._live = 0
+        self._tombstones = 0
+        self._compact_ratio = compact_ratio
+
+    def __len__(self):
+        """Returns the number of scheduled timers that are still active."""
+        return self._live
+
+    def schedule(self, deadline, job):
+        """Schedules job to become due at deadline and returns its Timer."""
+        timer = Timer(deadline, self._to_tick(deadline), job)
+        if timer._tick < self._current:
+            #The wheel has already passed this tick, fire on the next pop_due.
+            self._overdue.append(timer)
+        else:
+            self._place(timer)
+        self._live += 1
+        return timer
+
+    def cancel(self, timer):
+        """Cancels timer in O(1). Returns False if it had already fired or
+        been cancelled."""
+        if not timer._active:
+            return False
+        timer._active = False
+        self._live -= 1
+        self._tombstones += 1
+        if self._tombstones > self._compact_ratio * max(self._live, 64):
+            self._compact()
+        return True
+
+    def pop_due(self, now):
+        """Removes and returns the (deadline, job) pairs of every active timer
+        whose deadline is at or before now, in tick order."""
+        #Only ticks that now has fully reached are due, a deadline rounded
+        #up to tick t fires once now >= t * resolution.
+        target = math.floor(now / self._resolution)
+        due = []
+        if self._overdue:
+            self._overdue.sort(key=lambda timer: timer._tick)
+            split = 0
+            while split < len(self._overdue) and self._overdue[split]._tick <= target:
+                split += 1
+            self._fire(self._overdue[:split], due)
+            self._overdue = self._overdue[split:]
+        while self._current <= target:
+            if not any(self._counts):
+                if not self._live:
+                    #Only tombstones are left, drop them and jump ahead.
+                    self._compact()
+                    self._current = target + 1
+                    break
+                if not len(self._overflow):
+                    break
+                #The wheels are empty, skip straight to the next overflow tick.
+                tick = self._overflow.min()[0]
+                if tick > target:
+                    break
+                self._current = max(self._current, tick)
+                self._pull_overflow()
+                continue
+            if not self._counts[0]:
+                #Nothing can fire before the lowest non-empty level cascades,
+                #so jump to just before that slot boundary.
+                level = 1
+                while not self._counts[level]:
+                    level += 1
+                boundary = (self._current | ((1 << (self._bits * level)) - 1)) + 1
+                if boundary > target + 1:
+                    self._current = target + 1
+                    break
+                self._current = boundary - 1
+                self._advance()
+                continue
+            slot = self._current & self._mask
+            timers = self._wheels[0][slot]
+            if timers:
+                self._wheels[0][slot] = []
+                self._counts[0] -= len(timers)
+                self._fire(timers, due)
+            self._advance()
+        return due
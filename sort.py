@@ -1,3 +1,21 @@
+import array
+import heapq
+import os
+import pickle
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INSERTION_CUTOFF = 32
+NUMERIC_CUTOFF = 512
+
 def merge(S1, S2, S):
     i, j = 0, 0
     while i+j < len(S):
@@ -8,7 +26,24 @@ def merge(S1, S2, S):
             S[i+j] = S2[j]
             j += 1
 
-def merge_sort(S):
+def merge_sort(S, bottom_up=False, cutoff=INSERTION_CUTOFF, key=None,
+        reverse=False):
+    """Sorts S in place. Numeric buffers (array.array, memoryview or NumPy
+    arrays) are handed to a radix or counting sort when NumPy is available.
+    If bottom_up is True, uses the allocation-free hybrid merge sort instead
+    of the recursive top-down version. key and reverse work as for
+    sorted(), see _key_sort."""
+    if key is not None or reverse:
+        _key_sort(S, 0, len(S), key, reverse,
+                  lambda P, lo, hi: _hybrid_merge_sort(P, cutoff))
+        return
+    if _numeric_sort(S):
+        return
+    if bottom_up or not isinstance(S, (list, array.array)):
+        #Slices of memoryviews and NumPy arrays are views, which the top-down
+        #version would overwrite while merging.
+        _hybrid_merge_sort(S, cutoff)
+        return
     n = len(S)
     if n < 2:
         return S
@@ -19,30 +54,705 @@ def merge_sort(S):
     merge_sort(S2)
     merge(S1, S2, S)
 
-def quick_sort(S):
-    if len(S) < 2:
-        return
-    pivot = S[-1]
-    lesser = []
-    greater = []
-    equal = []
-    for element in S:
-        if element < pivot:
-            lesser.append(element)
-        elif element == pivot:
-            equal.append(element)
+def insertion_sort(S, lo=0, hi=None, key=None, reverse=False):
+    """Sorts S[lo:hi] in place using a stable binary insertion sort."""
+    if hi is None:
+        hi = len(S)
+    if key is not None or reverse:
+        _key_sort(S, lo, hi, key, reverse,
+                  lambda P, lo, hi: _binary_insertion_sort(P, lo, hi, lo + 1))
+        return
+    _binary_insertion_sort(S, lo, hi, lo + 1)
+
+def _key_sort(S, lo, hi, key, reverse, sorter):
+    """Sorts S[lo:hi] in place by key using sorter(P, lo, hi) on decorated
+    (key, index) pairs, so each key is computed exactly once and elements are
+    never compared themselves. The index also makes any sorter stable.
+    key is None, a function, or a sequence of columns for a composite key,
+    each a function or a (function, descending) pair."""
+    if key is None or callable(key):
+        columns = [(key, False)]
+    else:
+        columns = [c if isinstance(c, tuple) else (c, False) for c in key]
+    #Stable passes from the least significant column to the most significant
+    #one give the composite order with a direction per column.
+    for func, descending in reversed(columns):
+        _decorated_pass(S, lo, hi, func, descending != reverse, sorter)
+
+def _decorated_pass(S, lo, hi, key, reverse, sorter):
+    """Single decorate-sort-undecorate pass of _key_sort over one column."""
+    values = [S[i] for i in range(lo, hi)]
+    sign = -1 if reverse else 1
+    if key is None:
+        pairs = [(x, sign * i) for i, x in enumerate(values)]
+    else:
+        pairs = [(key(x), sign * i) for i, x in enumerate(values)]
+    sorter(pairs, 0, len(pairs))
+    if reverse:
+        #Sorting on (key, -index) and reversing keeps equal keys in their
+        #original order.
+        pairs.reverse()
+    for j, (_, i) in enumerate(pairs, lo):
+        S[j] = values[sign * i]
+
+def _binary_insertion_sort(S, lo, hi, start):
+    """Utility function that inserts S[start:hi] into the already sorted
+    S[lo:start]. Equal elements are inserted after existing ones."""
+    for i in range(max(start, lo + 1), hi):
+        x = S[i]
+        left, right = lo, i
+        while left < right:
+            mid = (left + right) // 2
+            if x < S[mid]:
+                right = mid
+            else:
+                left = mid + 1
+        j = i
+        while j > left:
+            S[j] = S[j-1]
+            j -= 1
+        S[left] = x
+
+def _reverse_range(S, lo, hi):
+    """Reverses S[lo:hi] in place."""
+    hi -= 1
+    while lo < hi:
+        S[lo], S[hi] = S[hi], S[lo]
+        lo += 1
+        hi -= 1
+
+def _count_run(S, lo, hi):
+    """Returns the end index of the natural run starting at lo. Strictly
+    descending runs are reversed in place so that every run is ascending."""
+    j = lo + 1
+    if j >= hi:
+        return hi
+    if S[j] < S[lo]:
+        j += 1
+        while j < hi and S[j] < S[j-1]:
+            j += 1
+        _reverse_range(S, lo, j)
+    else:
+        j += 1
+        while j < hi and not S[j] < S[j-1]:
+            j += 1
+    return j
+
+def _merge_runs(src, dst, lo, mid, hi):
+    """Stable merge of the sorted runs src[lo:mid] and src[mid:hi] into
+    dst[lo:hi]."""
+    i, j, k = lo, mid, lo
+    if not src[mid] < src[mid-1]:
+        #Runs are already in order, copy them across unchanged.
+        for k in range(lo, hi):
+            dst[k] = src[k]
+        return
+    while i < mid and j < hi:
+        if src[j] < src[i]:
+            dst[k] = src[j]
+            j += 1
         else:
-            greater.append(element)
-    quick_sort(lesser)
-    quick_sort(greater)
-    return lesser + equal + greater
+            dst[k] = src[i]
+            i += 1
+        k += 1
+    while i < mid:
+        dst[k] = src[i]
+        i += 1
+        k += 1
+    while j < hi:
+        dst[k] = src[j]
+        j += 1
+        k += 1
+
+def _hybrid_merge_sort(S, cutoff=INSERTION_CUTOFF):
+    """Bottom-up merge sort of S in place using a single auxiliary buffer.
+    Natural runs are detected first and short runs are extended to cutoff
+    elements with insertion sort, so nearly sorted input costs O(n)."""
+    n = len(S)
+    if n < 2:
+        return
+    cutoff = max(cutoff, 1)
+    bounds = [0]
+    lo = 0
+    while lo < n:
+        hi = _count_run(S, lo, n)
+        if hi - lo < cutoff:
+            forced = min(lo + cutoff, n)
+            _binary_insertion_sort(S, lo, forced, hi)
+            hi = forced
+        bounds.append(hi)
+        lo = hi
+    if len(bounds) == 2:
+        return
+    src, dst = S, S[:] if isinstance(S, (list, array.array)) else list(S)
+    while len(bounds) > 2:
+        merged = [0]
+        for r in range(2, len(bounds), 2):
+            _merge_runs(src, dst, bounds[r-2], bounds[r-1], bounds[r])
+            merged.append(bounds[r])
+        if len(bounds) % 2 == 0:
+            #Odd number of runs, the last one has no partner in this pass.
+            for k in range(bounds[-2], n):
+                dst[k] = src[k]
+            merged.append(n)
+        bounds = merged
+        src, dst = dst, src
+    if src is not S:
+        for k in range(n):
+            S[k] = src[k]
+
+def quick_sort(S, lo=0, hi=None, key=None, reverse=False):
+    """Sorts S[lo:hi] in place using introsort: quick sort with a ninther
+    pivot and 3-way partitioning, falling back to heap sort when the
+    partitioning depth exceeds 2*log(n). Uses O(log n) extra memory."""
+    if hi is None:
+        hi = len(S)
+    if hi - lo < 2:
+        return
+    if key is not None or reverse:
+        _key_sort(S, lo, hi, key, reverse, _introsort)
+    elif not _numeric_sort(S, lo, hi):
+        _introsort(S, lo, hi)
+
+def _introsort(S, lo, hi):
+    """Utility function for quick_sort that sorts S[lo:hi] in place."""
+    if hi - lo < 2:
+        return
+    stack = [(lo, hi, 2 * (hi - lo).bit_length())]
+    while stack:
+        lo, hi, depth = stack.pop()
+        while hi - lo > INSERTION_CUTOFF:
+            if depth == 0:
+                _heap_sort(S, lo, hi)
+                break
+            depth -= 1
+            lt, gt = _partition3(S, lo, hi, _choose_pivot(S, lo, hi))
+            #Defer the larger side and keep working on the smaller one, so
+            #the stack never holds more than log(n) ranges.
+            if lt - lo < hi - gt:
+                stack.append((gt, hi, depth))
+                hi = lt
+            else:
+                stack.append((lo, lt, depth))
+                lo = gt
+        else:
+            _binary_insertion_sort(S, lo, hi, lo + 1)
+
+def _median_of_three(S, a, b, c):
+    """Returns the median of the values S[a], S[b] and S[c]."""
+    x, y, z = S[a], S[b], S[c]
+    if y < x:
+        x, y = y, x
+    if z < y:
+        y = z
+        if y < x:
+            y = x
+    return y
+
+def _choose_pivot(S, lo, hi):
+    """Returns a pivot value for S[lo:hi]: median of three for small ranges,
+    Tukey's ninther for large ones."""
+    last = hi - 1
+    mid = (lo + last) // 2
+    if hi - lo < 128:
+        return _median_of_three(S, lo, mid, last)
+    step = (hi - lo) // 8
+    S3 = [_median_of_three(S, lo, lo + step, lo + 2*step),
+          _median_of_three(S, mid - step, mid, mid + step),
+          _median_of_three(S, last - 2*step, last - step, last)]
+    return _median_of_three(S3, 0, 1, 2)
+
+def _partition3(S, lo, hi, pivot):
+    """Dutch national flag partition of S[lo:hi] around pivot. Returns (lt,
+    gt) such that S[lo:lt] < pivot, S[lt:gt] == pivot and S[gt:hi] > pivot."""
+    lt, i, gt = lo, lo, hi
+    while i < gt:
+        x = S[i]
+        if x < pivot:
+            S[i] = S[lt]
+            S[lt] = x
+            lt += 1
+            i += 1
+        elif pivot < x:
+            gt -= 1
+            S[i] = S[gt]
+            S[gt] = x
+        else:
+            i += 1
+    return lt, gt
+
+def heap_sort(S, lo=0, hi=None, key=None, reverse=False):
+    """Sorts S[lo:hi] in place using an iterative max-heap sort."""
+    if hi is None:
+        hi = len(S)
+    if key is not None or reverse:
+        _key_sort(S, lo, hi, key, reverse, _heap_sort)
+    else:
+        _heap_sort(S, lo, hi)
+
+def _heap_sort(S, lo, hi):
+    """Utility function for heap_sort that sorts S[lo:hi] in place."""
+    n = hi - lo
+    for start in range(n//2 - 1, -1, -1):
+        _sift_down(S, lo, start, n)
+    for end in range(n - 1, 0, -1):
+        S[lo], S[lo + end] = S[lo + end], S[lo]
+        _sift_down(S, lo, 0, end)
+
+def _sift_down(S, base, j, n):
+    """Moves S[base+j] down the max-heap stored in S[base:base+n]."""
+    x = S[base + j]
+    child = 2*j + 1
+    while child < n:
+        if child + 1 < n and S[base + child] < S[base + child + 1]:
+            child += 1
+        if not x < S[base + child]:
+            break
+        S[base + j] = S[base + child]
+        j = child
+        child = 2*j + 1
+    S[base + j] = x
+
+def _as_numeric_array(S):
+    """Returns a writable one-dimensional NumPy view of S if S is a numeric
+    buffer, else None. No data is copied."""
+    if np is None or isinstance(S, list):
+        return None
+    if isinstance(S, np.ndarray):
+        a = S
+    elif isinstance(S, (array.array, memoryview)):
+        if isinstance(S, array.array) and S.typecode in ('u', 'w'):
+            return None
+        a = np.asarray(S)
+    else:
+        return None
+    if a.ndim != 1 or a.dtype.kind not in 'iuf' or not a.flags.writeable:
+        return None
+    return a
+
+def _numeric_sort(S, lo=0, hi=None):
+    """Sorts S[lo:hi] in place with a NumPy backend chosen by dtype and size:
+    counting sort for integers spanning a small range, LSD radix sort
+    otherwise. Returns False if S is not a large enough numeric buffer."""
+    a = _as_numeric_array(S)
+    if a is None:
+        return False
+    a = a[lo:hi]
+    if len(a) < NUMERIC_CUTOFF:
+        return False
+    if a.dtype.kind in 'iu':
+        low, high = int(a.min()), int(a.max())
+        if high - low < 2 * len(a):
+            _counting_sort_numpy(a, low, high)
+            return True
+    _radix_sort_numpy(a)
+    return True
+
+def _counting_sort_numpy(a, low, high):
+    """Sorts the integer array a in place, given its minimum and maximum."""
+    wide = a.astype(np.int64 if a.dtype.kind == 'i' else np.uint64)
+    counts = np.bincount((wide - low).astype(np.intp), minlength=high - low + 1)
+    a[:] = np.repeat(np.arange(low, high + 1, dtype=a.dtype), counts)
+
+def _radix_keys(a):
+    """Maps a to unsigned 64-bit keys with the same ordering."""
+    sign = np.uint64(1 << 63)
+    if a.dtype.kind == 'u':
+        return a.astype(np.uint64)
+    if a.dtype.kind == 'i':
+        return a.astype(np.int64).view(np.uint64) ^ sign
+    bits = a.astype(np.float64).view(np.uint64)
+    #Negative floats sort in reverse bit order, so flip all their bits.
+    return np.where(bits & sign, ~bits, bits | sign)
+
+def _radix_sort_numpy(a):
+    """LSD radix sort of the numeric array a in place, 16 bits per pass.
+    Each pass is a stable counting sort of one digit, and passes over
+    digits that are equal for every key are skipped."""
+    keys = _radix_keys(a)
+    varying = int(np.bitwise_or.reduce(keys ^ keys[0]))
+    order = None
+    for shift in range(0, 64, 16):
+        if not (varying >> shift) & 0xFFFF:
+            continue
+        digits = ((keys >> np.uint64(shift)) & np.uint64(0xFFFF)).astype(np.uint16)
+        if order is not None:
+            digits = digits[order]
+        perm = np.argsort(digits, kind='stable')
+        order = perm if order is None else order[perm]
+    if order is not None:
+        a[:] = a[order]
 
 def count_winner(S):
     """Given a sequence of integers with duplicates, return the integer with
     the highest number of duplicates."""
-    merge_sort(S)
-    counts = {}
-    for i in S:
-        counts.setdefault(S[i], 0)
-        counts[S[i]] += 1
-    return max(S, key = lambda key: S[key])
+    winners = heavy_hitters(S, 1)
+    if not winners:
+        raise ValueError("Sequence is empty.")
+    return winners[0][0]
+
+def heavy_hitters(stream, k=1, mode='exact', chunked=False, **options):
+    """Returns the k most frequent items of stream as (item, count) pairs,
+    most frequent first. If chunked is True, stream is an iterable of chunks
+    rather than of items. mode is 'exact', 'misra_gries' or 'count_min';
+    options are passed to the counter's constructor."""
+    counters = {'exact': ExactCounter, 'misra_gries': MisraGries,
+                'count_min': CountMinSketch}
+    if mode not in counters:
+        raise ValueError("Unknown mode: " + repr(mode))
+    if mode == 'misra_gries':
+        options.setdefault('capacity', max(k, 1) * 10)
+    elif mode == 'count_min':
+        options.setdefault('k', k)
+    counter = counters[mode](**options)
+    for chunk in (stream if chunked else (stream,)):
+        counter.update(chunk)
+    return counter.top(k)
+
+def _top_counts(counts, k):
+    """Returns the k (item, count) pairs of the dict counts with the highest
+    counts, highest first."""
+    return heapq.nlargest(k, counts.items(), key=lambda pair: pair[1])
+
+class ExactCounter:
+    """Exact frequencies of a stream, kept in a hash map. If bound is given and
+    NumPy is available, chunks of non-negative ints below bound are counted
+    with a single np.bincount call instead."""
+
+    def __init__(self, bound=None):
+        self._counts = {}
+        self._bins = None
+        if bound is not None and np is not None:
+            self._bins = np.zeros(bound, dtype=np.int64)
+
+    def update(self, chunk):
+        """Counts every item of the iterable chunk."""
+        if self._bins is not None:
+            a = _as_numeric_array(chunk)
+            if a is None and isinstance(chunk, list):
+                a = np.asarray(chunk)
+            if a is not None and a.dtype.kind in 'iu':
+                if not len(a):
+                    return
+                if a.min() >= 0 and a.max() < len(self._bins):
+                    self._bins += np.bincount(a, minlength=len(self._bins))
+                    return
+                #Out of range for the bins, count in the hash map instead.
+                chunk = a.tolist()
+        counts = self._counts
+        for item in chunk:
+            counts[item] = counts.get(item, 0) + 1
+
+    def __getitem__(self, item):
+        """Returns the number of times item was seen."""
+        count = self._counts.get(item, 0)
+        if self._bins is not None and type(item) is int and \
+                0 <= item < len(self._bins):
+            count += int(self._bins[item])
+        return count
+
+    def top(self, k):
+        """Returns the k most frequent items as (item, count) pairs."""
+        counts = self._counts
+        if self._bins is not None:
+            counts = dict(counts)
+            for item in np.flatnonzero(self._bins).tolist():
+                counts[item] = counts.get(item, 0) + int(self._bins[item])
+        return _top_counts(counts, k)
+
+class MisraGries:
+    """Misra-Gries summary of a stream in O(capacity) memory. Every item that
+    occurs more than n/(capacity+1) times in a stream of n items is kept, and
+    each reported count is low by at most n/(capacity+1)."""
+
+    def __init__(self, capacity=100):
+        self._capacity = capacity
+        self._counts = {}
+
+    def update(self, chunk):
+        """Counts every item of the iterable chunk."""
+        counts = self._counts
+        for item in chunk:
+            if item in counts:
+                counts[item] += 1
+            elif len(counts) < self._capacity:
+                counts[item] = 1
+            else:
+                #No free counter: decrement them all and drop those at zero.
+                for key in list(counts):
+                    if counts[key] == 1:
+                        del counts[key]
+                    else:
+                        counts[key] -= 1
+
+    def __getitem__(self, item):
+        """Returns the lower bound kept for the count of item."""
+        return self._counts.get(item, 0)
+
+    def top(self, k):
+        """Returns the k items with the highest counters as (item, count)
+        pairs."""
+        return _top_counts(self._counts, k)
+
+class CountMinSketch:
+    """Count-Min sketch of a stream in O(width*depth + k) memory. Estimates
+    never undercount and overcount by at most 2n/width with probability
+    1 - 2**-depth. The k items with the highest estimates seen so far are
+    tracked so that top() needs no second pass."""
+
+    def __init__(self, width=2048, depth=4, k=10):
+        self._width = width
+        self._rows = [[0] * width for _ in range(depth)]
+        self._seeds = [random.getrandbits(32) for _ in range(depth)]
+        self._k = k
+        self._candidates = {}
+        self._floor = None
+
+    def update(self, chunk):
+        """Counts every item of the iterable chunk."""
+        width = self._width
+        rows = self._rows
+        seeds = self._seeds
+        candidates = self._candidates
+        for item in chunk:
+            estimate = None
+            for row, seed in zip(rows, seeds):
+                j = hash((seed, item)) % width
+                row[j] += 1
+                if estimate is None or row[j] < estimate:
+                    estimate = row[j]
+            if item in candidates or len(candidates) < self._k:
+                candidates[item] = estimate
+                if self._floor is None or estimate < candidates[self._floor] \
+                        or item == self._floor:
+                    self._floor = min(candidates, key=candidates.get)
+            elif estimate > candidates[self._floor]:
+                del candidates[self._floor]
+                candidates[item] = estimate
+                self._floor = min(candidates, key=candidates.get)
+
+    def __getitem__(self, item):
+        """Returns the estimated count of item."""
+        return min(row[hash((seed, item)) % self._width]
+                   for row, seed in zip(self._rows, self._seeds))
+
+    def top(self, k):
+        """Returns up to k of the tracked heavy hitters as (item, estimate)
+        pairs."""
+        return _top_counts(self._candidates, k)
+
+def external_sort(iterable, run_size=100000, fan_in=64, tmpdir=None,
+        buffer_size=1 << 20):
+    """Generates the items of iterable in sorted order using memory bounded by
+    run_size items. Sorted runs are spilled to temporary files and combined
+    with a heap-driven k-way merge of at most fan_in runs at a time. Every
+    temporary file is removed when the generator finishes, fails or is
+    closed."""
+    created = []
+    paths = []
+    try:
+        run = []
+        for item in iterable:
+            run.append(item)
+            if len(run) == run_size:
+                merge_sort(run, bottom_up=True)
+                paths.append(_spill_run(run, tmpdir, buffer_size, created))
+                run = []
+        merge_sort(run, bottom_up=True)
+        if not paths:
+            #Everything fitted in a single run, no need to touch the disk.
+            yield from run
+            return
+        if run:
+            paths.append(_spill_run(run, tmpdir, buffer_size, created))
+        del run
+        fan_in = max(fan_in, 2)
+        while len(paths) > fan_in:
+            #Merge consecutive groups into a new, shorter list of runs so that
+            #equal items keep their original order.
+            merged_paths = []
+            for start in range(0, len(paths), fan_in):
+                group = paths[start:start + fan_in]
+                merged = _merge_runs_k(_read_run(p, buffer_size) for p in group)
+                merged_paths.append(_spill_run(merged, tmpdir, buffer_size, created))
+                for path in group:
+                    os.remove(path)
+            paths = merged_paths
+        yield from _merge_runs_k(_read_run(p, buffer_size) for p in paths)
+    finally:
+        for path in created:
+            if os.path.exists(path):
+                os.remove(path)
+
+_RUN_BLOCK = 1024
+
+def _spill_run(items, tmpdir, buffer_size, created):
+    """Writes the sorted items to a new temporary file as pickled blocks of
+    records and returns its path. The path is appended to the list created
+    before anything is written, and the file is removed if writing fails."""
+    fd, path = tempfile.mkstemp(suffix='.run', dir=tmpdir)
+    created.append(path)
+    try:
+        with os.fdopen(fd, 'wb', buffering=buffer_size) as f:
+            block = []
+            for item in items:
+                block.append(item)
+                if len(block) == _RUN_BLOCK:
+                    pickle.dump(block, f, pickle.HIGHEST_PROTOCOL)
+                    block = []
+            if block:
+                pickle.dump(block, f, pickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+def _read_run(path, buffer_size):
+    """Generates the records of a run file written by _spill_run."""
+    with open(path, 'rb', buffering=buffer_size) as f:
+        while True:
+            try:
+                block = pickle.load(f)
+            except EOFError:
+                return
+            yield from block
+
+class _RunHead:
+    """Heap entry for the k-way merge: the current item of a run, ordered by
+    item and then by run index so that the merge is stable."""
+    __slots__ = '_item', '_index', '_run'
+
+    def __init__(self, item, index, run):
+        self._item = item
+        self._index = index
+        self._run = run
+
+    def __lt__(self, other):
+        if self._item < other._item:
+            return True
+        if other._item < self._item:
+            return False
+        return self._index < other._index
+
+def _merge_runs_k(runs):
+    """Generates a stable k-way merge of the sorted iterators in runs."""
+    heap = []
+    for index, run in enumerate(runs):
+        run = iter(run)
+        for item in run:
+            heap.append(_RunHead(item, index, run))
+            break
+    heapq.heapify(heap)
+    while len(heap) > 1:
+        head = heap[0]
+        yield head._item
+        for item in head._run:
+            head._item = item
+            heapq.heapreplace(heap, head)
+            break
+        else:
+            heapq.heappop(heap)
+    if heap:
+        yield heap[0]._item
+        yield from heap[0]._run
+
+def parallel_merge_sort(S, workers=None, min_chunk=50000):
+    """Sorts S in place by sorting chunks of it in a process pool and merging
+    the sorted chunks with a k-way merge. Lists of 64-bit ints or floats and
+    arrays of typecode 'q' or 'd' are shared with the workers through shared
+    memory instead of being pickled."""
+    n = len(S)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunks = min(workers, n // max(min_chunk, 1))
+    if chunks < 2:
+        merge_sort(S, bottom_up=True)
+        return
+    bounds = [n * c // chunks for c in range(chunks + 1)]
+    typecode = _shared_typecode(S)
+    with ProcessPoolExecutor(max_workers=chunks) as pool:
+        if typecode is None:
+            runs = list(pool.map(_sort_chunk,
+                                 (S[lo:hi] for lo, hi in zip(bounds, bounds[1:]))))
+            _write_merged(S, _merge_runs_k(runs))
+            return
+        itemsize = array.array(typecode).itemsize
+        shm = shared_memory.SharedMemory(create=True, size=n * itemsize)
+        #The block may be rounded up to a whole page, only use the first n slots.
+        view = shm.buf[:n * itemsize].cast(typecode)
+        runs = []
+        try:
+            view[:] = S if isinstance(S, array.array) else array.array(typecode, S)
+            jobs = [(shm.name, typecode, lo, hi)
+                    for lo, hi in zip(bounds, bounds[1:])]
+            for _ in pool.map(_sort_shared_chunk, jobs):
+                pass
+            runs = [view[lo:hi] for lo, hi in zip(bounds, bounds[1:])]
+            _write_merged(S, _merge_runs_k(runs))
+        finally:
+            for run in runs:
+                run.release()
+            view.release()
+            shm.close()
+            shm.unlink()
+
+def _shared_typecode(S):
+    """Returns the array typecode used to share S with the workers, or None if
+    S has to be pickled."""
+    if isinstance(S, array.array):
+        return S.typecode if S.typecode in ('q', 'd') else None
+    if all(type(x) is float for x in S):
+        return 'd'
+    if all(type(x) is int and -2**63 <= x < 2**63 for x in S):
+        return 'q'
+    return None
+
+def _sort_chunk(chunk):
+    """Worker function for parallel_merge_sort on pickled chunks."""
+    merge_sort(chunk, bottom_up=True)
+    return chunk
+
+def _sort_shared_chunk(job):
+    """Worker function for parallel_merge_sort that sorts a slice of a shared
+    memory block in place."""
+    name, typecode, lo, hi = job
+    shm = shared_memory.SharedMemory(name=name)
+    view = shm.buf.cast(typecode)
+    try:
+        chunk = view[lo:hi].tolist()
+        merge_sort(chunk, bottom_up=True)
+        view[lo:hi] = array.array(typecode, chunk)
+    finally:
+        view.release()
+        shm.close()
+
+def _write_merged(S, merged):
+    """Overwrites S with the items generated by merged."""
+    for k, item in enumerate(merged):
+        S[k] = item
+
+def benchmark_parallel_sort(n=1000000, max_workers=None, typecode='d'):
+    """Times parallel_merge_sort against the serial bottom-up merge_sort on n
+    random numbers for 1, 2, 4, ... workers. Prints and returns a list of
+    (workers, seconds, speedup) tuples."""
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if typecode == 'd':
+        data = [random.random() for _ in range(n)]
+    else:
+        data = [random.randrange(-2**63, 2**63) for _ in range(n)]
+    results = []
+    workers = 1
+    while workers <= max_workers:
+        S = data[:]
+        start = time.perf_counter()
+        if workers == 1:
+            merge_sort(S, bottom_up=True)
+        else:
+            parallel_merge_sort(S, workers=workers, min_chunk=1)
+        elapsed = time.perf_counter() - start
+        speedup = results[0][1] / elapsed if results else 1.0
+        results.append((workers, elapsed, speedup))
+        print("workers=%d  %.3fs  speedup=%.2fx" % (workers, elapsed, speedup))
+        workers *= 2
+    return results